@@ -1,11 +1,57 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory, session
+from flask import Flask, Request, render_template, jsonify, request, send_from_directory, send_file, session, abort, g, has_request_context
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+from urllib.parse import quote
 from flask_cors import CORS
+import click
 from functools import wraps
+from contextlib import contextmanager, ExitStack
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import json
 import os
 from datetime import datetime
 import uuid
 import secrets
+import hashlib
+import threading
+import atexit
+import sqlite3
+import gzip
+import mimetypes
+import re
+import time
+import base64
+import shutil
+import bisect
+import math
+import multiprocessing
+import glob
+import zipfile
+import tempfile
+import unicodedata
+
+try:
+    import fcntl
+except ImportError:  # Windows本地开发时没有fcntl，文件锁退化为进程内锁
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # 已写进 requirements.txt；没有安装时（如本地开发）只提供 gzip
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # 已写进 requirements.txt；没有安装时 JS 不压缩，只加内容哈希
+    rjsmin = None
+
+try:
+    from PIL import Image
+    from image_derivatives import build_image_derivatives
+except ImportError:  # 没有安装 Pillow 时不生成缩略图，直接提供原图
+    Image = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(16))  # 用于session加密
@@ -14,16 +60,76 @@ CORS(app)
 # 配置
 UPLOAD_FOLDER = 'static/uploads'
 FILES_FOLDER = 'static/files'
+CACHE_FOLDER = '.cache'  # 生成的文件（压缩版本等），可随时删除
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_FILE_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt', 'zip', 'rar', 'mp4', 'mp3', 'avi', 'mkv', 'xlsx', 'xls', 'ppt', 'pptx', 'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'svg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['FILES_FOLDER'] = FILES_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB最大上传
+UPLOAD_SAVE_WORKERS = 4  # 批量上传时并发写盘的线程数
+# 分块上传：单个文件的大小上限、每块的建议大小、未完成的上传保留多久
+MAX_CHUNKED_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+# 恢复备份一次上传整个站点（可能包含多个大文件），不受上面 50MB 的限制
+MAX_BACKUP_UPLOAD_SIZE = int(os.environ.get('MAX_BACKUP_UPLOAD_SIZE', 20 * 1024 * 1024 * 1024))
+
+# 文件下载交给前置代理发送：''（应用自己发送，gunicorn 下用 sendfile 零拷贝）、
+# 'x-sendfile'（Apache/lighttpd）或 'x-accel'（nginx，internal location 指向 FILES_FOLDER）
+FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD', '')
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/_protected_files/')
+# 图片缩略图：上传后按这些宽度生成缩放版和 WebP 版，通过 /static/uploads/<name>?w=320 访问
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+DERIVATIVE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+DERIVATIVE_WORKERS = 2
+COMPRESS_MIN_SIZE = 1024  # 超过这个大小的 JSON 响应才压缩
+COMPRESSIBLE_EXTENSIONS = {'.js', '.css', '.svg', '.json', '.txt', '.html'}
+# 构建好的 css/js（文件名带内容哈希），内容不会变，浏览器可以永久缓存
+ASSET_BUILD_FOLDER = 'build'  # 相对 static 目录
+ASSET_SOURCES = ('js/*.js', 'css/*.css')
+ASSET_MAX_AGE = 365 * 24 * 3600
+FILE_SCAN_INTERVAL = 6 * 60 * 60  # 后台检查文件完整性的间隔（秒）
+# 访问分析：按分钟/小时/天汇总，分别保留多久（秒，None 表示一直保留）
+ANALYTICS_RETENTION = {'minute': 2 * 24 * 60 * 60, 'hour': 90 * 24 * 60 * 60, 'day': None}
+ANALYTICS_TOP_N = 100  # 每个小时/天的桶里保留访问最多的 N 个 UA 和来源
+ANALYTICS_MAX_POINTS = 2000  # 一次查询最多返回的桶数
+# 内容变化推送（SSE）：gthread worker 里每个连接占一个线程，所以限制连接数并定期断开重连。
+# 默认关闭：打开后每个访客的页面都占一个线程，需要同时调大 gunicorn 的 --threads，
+# 保证 SSE_MAX_STREAMS 之外还有足够的线程处理普通请求
+SSE_ENABLED = os.environ.get('LIVE_UPDATES', '') == '1'
+SSE_POLL_INTERVAL = 1.0  # 检查数据版本的间隔（秒）
+SSE_MAX_STREAMS = int(os.environ.get('LIVE_UPDATES_MAX_STREAMS', '2'))  # 每个 worker 同时保持的推送连接数
+SSE_STREAM_DURATION = 5 * 60  # 单个连接保持多久后断开，浏览器按 retry 自动重连
+SSE_HEARTBEAT = 15
+SSE_RETRY_MS = 3000
+# 静态站点导出：设置后每次保存内容都在后台把公开首页重新导出到这个目录
+STATIC_EXPORT_FOLDER = os.environ.get('STATIC_EXPORT_FOLDER', '')
+
+class AppRequest(Request):
+    """Flask 只有全局的 MAX_CONTENT_LENGTH：恢复备份的接口换成自己的上限"""
+
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'import_backup':
+            return MAX_BACKUP_UPLOAD_SIZE
+        return super().max_content_length
+
+
+app.request_class = AppRequest
 
 # 数据存储文件
 DATA_FILE = 'data.json'
+DATA_JOURNAL_FILE = 'data.journal'
 STATS_FILE = 'stats.json'
 FILES_DB_FILE = 'files.json'
+FILES_SQLITE_FILE = 'files.db'
+ANALYTICS_DB_FILE = 'analytics.db'
+METRICS_FOLDER = os.path.join(CACHE_FOLDER, 'metrics')
+# 抓取 /metrics 时除了管理员登录，也可以用 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 文件目录的存储后端：sqlite（默认，带索引）或 json（旧的 files.json）
+FILES_BACKEND = os.environ.get('FILES_BACKEND', 'sqlite')
 
 # 确保目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -83,21 +189,1020 @@ def init_data():
         with open(FILES_DB_FILE, 'w', encoding='utf-8') as f:
             json.dump([], f, ensure_ascii=False, indent=2)
 
+def fsync_directory(path):
+    """把目录项（rename/新建）落盘，否则断电后 rename 可能丢失"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # 不支持打开目录的平台（Windows）
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path, raw, durable=False):
+    """先写临时文件再原子替换，崩溃时不会留下半截文件；返回新文件的 stat
+
+    durable=True 时在替换前后 fsync 文件和目录，断电后也能保证新内容已经落盘
+    （其他文件依赖它的时候使用，例如压缩后要清空的日志）。
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+        f.flush()
+        if durable:
+            os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    os.replace(tmp_path, path)
+    if durable:
+        fsync_directory(path)
+    return st
+
+
+class FileLock:
+    """跨进程文件锁（fcntl.flock），同一线程内可重入
+
+    多个 gunicorn worker 读-改-写同一个文件时用它串行化。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = open(self.path, 'a')
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    self._fd.close()
+                    self._fd = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._fd.close()
+            self._fd = None
+        self._lock.release()
+
+
+# 只读视图：共享的缓存文档用这两个类冻结，任何请求都无法修改共享副本
+class _FrozenDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('缓存数据是只读的，请使用 load_data() 获取可修改的副本')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+class _FrozenList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('缓存数据是只读的，请使用 load_data() 获取可修改的副本')
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return _FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return _FrozenList(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    """复制JSON结构（比 copy.deepcopy 快得多），返回普通 dict/list"""
+    if isinstance(value, dict):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_thaw(v) for v in value]
+    return value
+
+
+def _diff_ops(old, new, path, ops):
+    """比较两份文档，生成把 old 变成 new 的最少修改记录（只深入到 dict，list 整体替换）"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(['del', path + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(['set', path + [key], value])
+            else:
+                _diff_ops(old[key], value, path + [key], ops)
+    elif old != new or isinstance(old, bool) != isinstance(new, bool):
+        ops.append(['set', path, new])
+    return ops
+
+
+def _apply_op(doc, op):
+    """在可修改的文档上原地执行一条修改记录，中间缺失的层级自动补上"""
+    *parents, key = op[1]
+    node = doc
+    for part in parents:
+        if not isinstance(node.get(part), dict):
+            node[part] = {}
+        node = node[part]
+    if op[0] == 'set':
+        node[key] = op[2]
+    else:
+        node.pop(key, None)
+
+
+def _apply_op_frozen(node, path, op):
+    """在只读文档上执行修改记录：只复制路径上的几层 dict，其余部分共享"""
+    node = dict(node) if isinstance(node, dict) else {}
+    key = path[0]
+    if len(path) > 1:
+        node[key] = _apply_op_frozen(node.get(key), path[1:], op)
+    elif op[0] == 'set':
+        node[key] = _freeze(op[2])
+    else:
+        node.pop(key, None)
+    return _FrozenDict(node)
+
+
+class DocumentConflict(Exception):
+    """If-Match 的版本和当前文档不一致"""
+
+    def __init__(self, etag):
+        super().__init__(etag)
+        self.etag = etag
+
+
+def etag_matches(etags, etag):
+    # 压缩过的响应 ETag 带 -gzip/-br 后缀（见 compress_response）
+    return next((candidate for candidate in (etag, f'{etag}-gzip', f'{etag}-br')
+                 if etags.contains(candidate)), None)
+
+
+class DocumentStore:
+    """JSON文档的存储引擎：快照 + 追加日志
+
+    - path 是快照（保持 indent=2 的可读格式，手工编辑、Git 部署照旧）；
+      每次保存只把变化的部分以一行紧凑 JSON 追加到 journal_path，
+      写入代价和改动大小成正比，追加不会破坏已有内容。
+    - 日志积累到 compact_every 条或 compact_bytes 字节后，把完整文档
+      写成新快照（临时文件 + rename 原子替换）并清空日志。
+    - 解析后的文档常驻内存，每次读取只做 os.stat：快照变了就重新加载，
+      日志变长了只回放新增的几行，另一个 gunicorn worker 的修改也能及时看到。
+    - read() 返回共享的只读文档，load() 返回可修改的副本。
+
+    日志第一行记录它所基于的快照哈希。快照被替换过（手工编辑、部署，或压缩时
+    在替换快照和清空日志之间崩溃）时旧日志与快照对不上，直接作废，不会回放。
+    """
+
+    def __init__(self, path, journal_path, compact_every=200, compact_bytes=1024 * 1024):
+        self.path = path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.compact_bytes = compact_bytes
+        self.version = 0  # 本进程内文档每变化一次 +1
+        self.etag = None  # 快照和日志内容的链式哈希，各 worker 之间一致
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(journal_path + '.lock')
+        self._signature = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._journal_stale = False
+        self._base = None
+        self._doc = None
+        self._derived = {}
+        self._listeners = []
+
+    def _stat_signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _journal_stat(self):
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def _read_journal(self, offset):
+        """读取 offset 之后完整的日志行；最后一行没写完（崩溃）时忽略"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = chunk.rfind(b'\n') + 1
+        return chunk[:end].splitlines(), offset + end
+
+    def _parse_line(self, line):
+        """解析一行日志：修改记录是 list，第一行的快照头是 dict"""
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            print(f'跳过损坏的日志记录: {str(e)}')
+            return []
+
+    def _set_doc(self, doc):
+        self._doc = doc
+        self.version += 1
+        self._derived = {}
+
+    def _reload(self, signature):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        metrics.inc('storage_bytes_read_total', {'file': self.path}, len(raw))
+        started = time.perf_counter()
+        doc = json.loads(raw)
+        etag = self._base = hashlib.sha1(raw).hexdigest()
+        journal_ino, _ = self._journal_stat()
+        lines, offset = self._read_journal(0)
+        self._journal_stale = bool(lines) and self._parse_line(lines[0]) != {'base': self._base}
+        if self._journal_stale:
+            lines = []
+        for line in lines:
+            ops = self._parse_line(line)
+            for op in ops if isinstance(ops, list) else []:
+                _apply_op(doc, op)
+            etag = hashlib.sha1(etag.encode() + line).hexdigest()
+        metrics.inc('storage_bytes_read_total', {'file': self.journal_path}, offset)
+        metrics.observe('storage_parse_duration_seconds', {'file': self.path}, time.perf_counter() - started)
+        self._signature = signature
+        self._journal_ino = journal_ino
+        self._journal_offset = offset
+        self._journal_records = len(lines)
+        self.etag = etag
+        self._set_doc(_freeze(doc))
+
+    def _catch_up(self):
+        """回放新追加的日志"""
+        self._journal_ino, _ = self._journal_stat()
+        lines, offset = self._read_journal(self._journal_offset)
+        if not lines:
+            return
+        metrics.inc('storage_bytes_read_total', {'file': self.journal_path}, offset - self._journal_offset)
+        doc = self._doc
+        for line in lines:
+            ops = self._parse_line(line)
+            for op in ops if isinstance(ops, list) else []:
+                doc = _apply_op_frozen(doc, op[1], op)
+            self.etag = hashlib.sha1(self.etag.encode() + line).hexdigest()
+        self._journal_offset = offset
+        self._journal_records += len(lines)
+        self._set_doc(doc)
+
+    def read(self):
+        signature = self._stat_signature()
+        journal_ino, journal_size = self._journal_stat()
+        if (signature != self._signature or journal_ino != self._journal_ino
+                or journal_size != self._journal_offset):
+            with self._lock:
+                signature = self._stat_signature()
+                journal_ino, journal_size = self._journal_stat()
+                if (signature != self._signature or journal_size < self._journal_offset
+                        or (self._journal_ino is not None and journal_ino != self._journal_ino)):
+                    self._reload(signature)
+                elif journal_size > self._journal_offset:
+                    self._catch_up()
+        return self._doc
+
+    def load(self):
+        return _thaw(self.read())
+
+    def save(self, doc):
+        with self._file_lock:
+            current = self.read()
+            ops = _diff_ops(current, doc, [], [])
+            if not ops:
+                return
+            line = json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            if self._journal_offset == 0 or self._journal_stale:
+                # 新日志（或作废的旧日志）从快照头开始写
+                header = json.dumps({'base': self._base}).encode('utf-8') + b'\n'
+                line = header + line
+                self._journal_offset = self._journal_records = 0
+                self._journal_stale = False
+                if os.path.exists(self.journal_path):
+                    os.truncate(self.journal_path, 0)
+            elif self._journal_stat()[1] > self._journal_offset:
+                # 上次写入中途崩溃留下的半行，截掉后再追加
+                os.truncate(self.journal_path, self._journal_offset)
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+                metrics.inc('storage_bytes_written_total', {'file': self.journal_path}, len(line))
+            finally:
+                os.close(fd)
+            with self._lock:
+                self._catch_up()
+            for listener in self._listeners:
+                listener()
+            if (self._journal_records >= self.compact_every
+                    or self._journal_offset >= self.compact_bytes):
+                self.compact()
+
+    def subscribe(self, listener):
+        """保存成功后调用 listener()（在保存的线程里，持有写锁，应尽快返回）"""
+        self._listeners.append(listener)
+
+    def locked(self):
+        """跨进程的写锁：持有期间其他 worker 不能保存文档（同一线程内可重入）"""
+        return self._file_lock
+
+    def apply(self, mutate, if_match=None):
+        """在文件锁里读出最新文档、检查版本、修改并保存，返回保存后的 ETag
+
+        mutate 接收可修改的副本，返回新文档；if_match 是请求的 If-Match
+        （ETags 对象），和当前版本不符时抛出 DocumentConflict，不做任何修改。
+        """
+        with self._file_lock:
+            current = self.read()
+            if if_match and not if_match.star_tag and not etag_matches(if_match, self.etag):
+                raise DocumentConflict(self.etag)
+            self.save(mutate(_thaw(current)))
+            self.read()
+            return self.etag
+
+    def compact(self):
+        """把当前文档写成新快照并清空日志"""
+        with self._file_lock:
+            doc = self.read()
+            raw = json.dumps(doc, ensure_ascii=False, indent=2).encode('utf-8')
+            # 快照必须先落盘，再清空日志，否则断电后两者可能都丢失
+            st = atomic_write(self.path, raw, durable=True)
+            metrics.inc('storage_bytes_written_total', {'file': self.path}, len(raw))
+            if os.path.exists(self.journal_path):
+                os.truncate(self.journal_path, 0)
+            with self._lock:
+                self._signature = (st.st_mtime_ns, st.st_ino, st.st_size)
+                self._journal_ino, _ = self._journal_stat()
+                self._journal_offset = 0
+                self._journal_records = 0
+                self._journal_stale = False
+                self.etag = self._base = hashlib.sha1(raw).hexdigest()
+
+    def derived(self, name, build):
+        """按文档版本缓存派生结果（如去掉密码的公开数据），文档变化后自动重建"""
+        doc = self.read()
+        entry = self._derived.get(name)
+        if entry is None or entry[0] is not doc:
+            entry = (doc, build(doc))
+            self._derived[name] = entry
+        return entry[1]
+
+
+data_store = DocumentStore(DATA_FILE, DATA_JOURNAL_FILE)
+
 def load_data():
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """返回可修改的数据副本，修改后用 save_data() 保存
+
+    在请求里调用时返回这个请求的工作单元里的同一份文档（见 DataUnitOfWork）。
+    """
+    unit_of_work = current_unit_of_work()
+    if unit_of_work is not None:
+        return unit_of_work.load()
+    with metrics.timer('load_data'):
+        return data_store.load()
+
+def read_data():
+    """返回缓存中的只读数据，只读的路由使用，无需复制"""
+    return data_store.read()
+
+def public_data():
+    """不含密码的只读数据"""
+    return data_store.derived('public', lambda doc: _freeze(
+        {k: v for k, v in doc.items() if k != 'admin_password'}))
 
 def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """保存数据；在请求里只是标记修改，请求结束时由工作单元统一写入"""
+    unit_of_work = current_unit_of_work()
+    if unit_of_work is not None:
+        unit_of_work.save(data)
+        return
+    with metrics.timer('save_data'):
+        data_store.save(data)
+
+
+class DataUnitOfWork:
+    """请求内的工作单元
+
+    第一次 load_data() 时拿到文档的跨进程写锁并读取一份可修改的副本，之后同一个
+    请求里再调用都返回这一份；save_data() 只标记修改。请求成功结束时把修改
+    一次性保存，最后释放锁。读取和保存之间其他 worker 不能写入，读-改-写不会
+    互相覆盖。
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.doc = None
+        self.dirty = False
+        self._stack = ExitStack()
+
+    def load(self):
+        if self.doc is None:
+            self._stack.enter_context(self.store.locked())
+            with metrics.timer('load_data'):
+                self.doc = self.store.load()
+        return self.doc
+
+    def save(self, doc):
+        if self.doc is None:
+            self._stack.enter_context(self.store.locked())
+        self.doc = doc
+        self.dirty = True
+
+    def commit(self):
+        if self.dirty:
+            with metrics.timer('save_data'):
+                self.store.save(self.doc)
+            self.dirty = False
+
+    def close(self):
+        self.doc = None
+        self.dirty = False
+        self._stack.close()
+
+
+def current_unit_of_work():
+    if not has_request_context():
+        return None
+    if 'data_unit_of_work' not in g:
+        g.data_unit_of_work = DataUnitOfWork(data_store)
+    return g.data_unit_of_work
 
 def load_stats():
     with open(STATS_FILE, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 def save_stats(stats):
-    with open(STATS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(stats, f, ensure_ascii=False, indent=2)
+    atomic_write(STATS_FILE, json.dumps(stats, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+class BackgroundWorker:
+    """后台线程的基类：每 interval 秒（或 wake() 之后立即）调用一次 run_once()"""
+
+    label = '后台任务'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None and not self._stopped:
+            # 延迟到第一次使用时启动，gunicorn fork 出的每个 worker 各有一个线程
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        """停止后台线程并等它退出（测试结束时使用），之后不会再启动"""
+        self._stopped = True
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped:
+                return
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f'{self.label}错误: {str(e)}')
+
+    def run_once(self):
+        raise NotImplementedError
+
+
+class BackgroundFlusher(BackgroundWorker):
+    """写缓冲的基类：后台线程每 flush_interval 秒调用一次 flush()，
+    缓冲的条数达到 flush_threshold 时提前触发"""
+
+    label = '写入缓冲数据'
+
+    def __init__(self, flush_interval, flush_threshold):
+        super().__init__(flush_interval)
+        self.flush_threshold = flush_threshold
+
+    def _pending_changed(self, pending):
+        """记录一条数据后调用（持有 self._lock）"""
+        self._ensure_started()
+        if pending >= self.flush_threshold:
+            self.wake()
+
+    def run_once(self):
+        self.flush()
+
+    def flush(self):
+        raise NotImplementedError
+
+
+class Metrics(BackgroundWorker):
+    """Prometheus 格式的监控指标
+
+    每个 worker 在内存里累计计数器和直方图，后台线程定时把本进程的累计值写到
+    .cache/metrics/<pid>-<id>.json；/metrics 读取所有 worker 的文件相加后输出。
+    """
+
+    label = '写入监控指标'
+    HELP = {
+        'http_requests_total': ('counter', '按路由、方法和状态码统计的请求数'),
+        'http_request_duration_seconds': ('histogram', '按路由统计的请求耗时'),
+        'storage_operation_duration_seconds': ('histogram', 'load_data/save_data、文件目录（files_*）等存储调用和模板渲染的耗时'),
+        'storage_parse_duration_seconds': ('histogram', '解析 JSON 数据文件的耗时'),
+        'storage_bytes_read_total': ('counter', '从数据文件读取的字节数'),
+        'storage_bytes_written_total': ('counter', '写入数据文件的字节数'),
+    }
+
+    def __init__(self, directory, flush_interval=15):
+        super().__init__(flush_interval)
+        self.directory = directory
+        self.path = os.path.join(directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        self._pid = os.getpid()
+        self._counters = {}  # (指标名, 标签) -> 累计值
+        self._histograms = {}  # (指标名, 标签) -> [各个桶的累计次数..., 总和]
+
+    def _key(self, name, labels):
+        if self._pid != os.getpid():
+            # fork 出来的 worker 不继承父进程的计数，写自己的文件
+            self._pid = os.getpid()
+            self.path = os.path.join(self.directory, f'{self._pid}-{uuid.uuid4().hex[:8]}.json')
+            self._counters, self._histograms, self._thread = {}, {}, None
+        self._ensure_started()
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        with self._lock:
+            key = self._key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            key = self._key(name, labels)
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(METRICS_BUCKETS) + 2)
+            for i, bound in enumerate(METRICS_BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += seconds
+
+    @contextmanager
+    def timer(self, operation):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('storage_operation_duration_seconds', {'operation': operation},
+                         time.perf_counter() - started)
+
+    def run_once(self):
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            snapshot = {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(counts)] for (name, labels), counts in self._histograms.items()]
+            }
+        if not snapshot['counters'] and not snapshot['histograms']:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(self.path, json.dumps(snapshot, ensure_ascii=False).encode('utf-8'))
+        self._archive_exited()
+
+    @staticmethod
+    def _merge(snapshot, counters, histograms):
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, [0] * len(counts))
+            histograms[key] = [a + b for a, b in zip(merged, counts)]
+
+    def _read_snapshots(self):
+        """返回 [(文件名, 内容)]"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+        snapshots = []
+        for filename in names:
+            try:
+                with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                    snapshots.append((filename, json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def _archive_exited(self):
+        """把已经退出的 worker 的文件合并进 exited.json 后删除，目录里只剩运行中的 worker
+
+        gunicorn 回收 worker 或应用重启后 pid 会变，不合并的话文件越积越多。
+        """
+        with FileLock(os.path.join(self.directory, 'exited.lock')):
+            exited = []
+            for filename, snapshot in self._read_snapshots():
+                match = re.fullmatch(r'(\d+)-[0-9a-f]+\.json', filename)
+                if match is None or filename == os.path.basename(self.path):
+                    continue
+                pid = int(match.group(1))
+                if pid != os.getpid():
+                    try:
+                        os.kill(pid, 0)
+                        continue
+                    except ProcessLookupError:
+                        pass
+                    except PermissionError:
+                        continue
+                exited.append((filename, snapshot))
+            if not exited:
+                return
+            counters, histograms = {}, {}
+            archive = os.path.join(self.directory, 'exited.json')
+            try:
+                with open(archive, 'r', encoding='utf-8') as f:
+                    self._merge(json.load(f), counters, histograms)
+            except (FileNotFoundError, ValueError):
+                pass
+            for _, snapshot in exited:
+                self._merge(snapshot, counters, histograms)
+            atomic_write(archive, json.dumps({
+                'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                'histograms': [[name, list(labels), counts] for (name, labels), counts in histograms.items()]
+            }, ensure_ascii=False).encode('utf-8'))
+            for filename, _ in exited:
+                os.remove(os.path.join(self.directory, filename))
+
+    def collect(self):
+        """合并所有 worker（包括已经退出的，见 exited.json）写下的累计值"""
+        self.flush()
+        counters, histograms = {}, {}
+        for _, snapshot in self._read_snapshots():
+            self._merge(snapshot, counters, histograms)
+        return counters, histograms
+
+    def render(self):
+        """输出 Prometheus 文本格式"""
+        counters, histograms = self.collect()
+
+        def fmt(labels, extra=()):
+            pairs = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for k, v in list(labels) + list(extra)]
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+
+        lines = []
+        for name, (kind, help_text) in self.HELP.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{fmt(labels)} {value}')
+            else:
+                for (metric, labels), counts in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(METRICS_BUCKETS, counts):
+                        lines.append(f'{name}_bucket{fmt(labels, [("le", bound)])} {count}')
+                    lines.append(f'{name}_bucket{fmt(labels, [("le", "+Inf")])} {counts[-2]}')
+                    lines.append(f'{name}_sum{fmt(labels)} {counts[-1]}')
+                    lines.append(f'{name}_count{fmt(labels)} {counts[-2]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(METRICS_FOLDER)
+atexit.register(metrics.flush)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # 在 compress_response 之前注册，所以最后执行，耗时包含压缩
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method,
+                                            'status': str(response.status_code)})
+        metrics.observe('http_request_duration_seconds', {'endpoint': endpoint},
+                        time.perf_counter() - started)
+    return response
+
+# 工作单元的提交在 record_request_metrics 之后注册，所以先执行，指标里包含提交的耗时和结果
+@app.after_request
+def commit_data_changes(response):
+    unit_of_work = g.get('data_unit_of_work')
+    if unit_of_work is None or not unit_of_work.dirty:
+        return response
+    if response.status_code >= 400:
+        # 出错的请求不保存中途的修改
+        return response
+    try:
+        unit_of_work.commit()
+    except Exception as e:
+        print(f'保存数据错误: {str(e)}')
+        response = jsonify({'success': False, 'message': f'保存失败: {str(e)}'})
+        response.status_code = 500
+    return response
+
+@app.teardown_request
+def close_data_unit_of_work(exc):
+    unit_of_work = g.pop('data_unit_of_work', None)
+    if unit_of_work is not None:
+        unit_of_work.close()
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计：2^p 个单字节寄存器（p=10 时 1KB），误差约 1.04/sqrt(2^p)，可以直接合并"""
+
+    def __init__(self, registers=None, p=10):
+        self.p = p
+        self.registers = bytearray(registers) if registers else bytearray(1 << p)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, registers):
+        self.registers = bytearray(map(max, self.registers, registers))
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 基数较小时用线性计数更准
+            return round(m * math.log(m / zeros))
+        return round(estimate)
+
+
+def bucket_start(dt, granularity):
+    if granularity == 'minute':
+        dt = dt.replace(second=0, microsecond=0)
+    elif granularity == 'hour':
+        dt = dt.replace(minute=0, second=0, microsecond=0)
+    else:
+        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(dt.timestamp())
+
+
+class VisitAnalytics:
+    """访问分析：把访问按分钟/小时/天汇总到 analytics.db
+
+    每个桶记录访问次数和独立 IP 的 HyperLogLog 草图；小时和天的桶另外保留
+    访问最多的 ANALYTICS_TOP_N 个 UA 和来源。查询任意时间段只需要按桶合并，
+    内存占用和原始访问记录的条数无关。
+    """
+
+    GRANULARITIES = ('minute', 'hour', 'day')
+    STEPS = {'minute': 60, 'hour': 60 * 60, 'day': 24 * 60 * 60}
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = FileLock(path + '.lock')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # 切换 WAL 和建表在多个 worker 同时首次打开时会报 database is locked，串行执行
+            with self._init_lock:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                conn.executescript('''
+                    CREATE TABLE IF NOT EXISTS buckets (
+                        granularity TEXT NOT NULL,
+                        start INTEGER NOT NULL,
+                        visits INTEGER NOT NULL DEFAULT 0,
+                        unique_ips BLOB,
+                        PRIMARY KEY (granularity, start)
+                    );
+                    CREATE TABLE IF NOT EXISTS top_items (
+                        granularity TEXT NOT NULL,
+                        start INTEGER NOT NULL,
+                        kind TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (granularity, start, kind, value)
+                    );
+                ''')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def rollup(pending, visitor_log, now=None):
+        """在内存里把一条访问累加进 pending {(粒度, 桶起点): 汇总}"""
+        now = now or datetime.now()
+        for granularity in VisitAnalytics.GRANULARITIES:
+            key = (granularity, bucket_start(now, granularity))
+            bucket = pending.get(key)
+            if bucket is None:
+                bucket = pending[key] = {'visits': 0, 'unique_ips': HyperLogLog(),
+                                         'user_agent': Counter(), 'referrer': Counter()}
+            bucket['visits'] += 1
+            bucket['unique_ips'].add(visitor_log['ip'])
+            if granularity != 'minute':
+                bucket['user_agent'][visitor_log.get('user_agent') or 'Unknown'] += 1
+                bucket['referrer'][visitor_log.get('referrer') or '(direct)'] += 1
+
+    @staticmethod
+    def combine(pending, other):
+        """把 other 合并进 pending（写入失败时放回缓冲用）"""
+        for key, bucket in other.items():
+            if key not in pending:
+                pending[key] = bucket
+                continue
+            target = pending[key]
+            target['visits'] += bucket['visits']
+            target['unique_ips'].merge(bucket['unique_ips'].registers)
+            target['user_agent'].update(bucket['user_agent'])
+            target['referrer'].update(bucket['referrer'])
+
+    def merge(self, pending):
+        """把一批汇总写进数据库，并清理过期的桶"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for (granularity, start), bucket in pending.items():
+                row = conn.execute('SELECT unique_ips FROM buckets WHERE granularity = ? AND start = ?',
+                                   (granularity, start)).fetchone()
+                sketch = bucket['unique_ips']
+                if row is not None and row[0]:
+                    sketch.merge(row[0])
+                conn.execute('''
+                    INSERT INTO buckets (granularity, start, visits, unique_ips) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (granularity, start)
+                    DO UPDATE SET visits = visits + excluded.visits, unique_ips = excluded.unique_ips
+                ''', (granularity, start, bucket['visits'], bytes(sketch.registers)))
+                for kind in ('user_agent', 'referrer'):
+                    if not bucket[kind]:
+                        continue
+                    conn.executemany('''
+                        INSERT INTO top_items (granularity, start, kind, value, count) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (granularity, start, kind, value) DO UPDATE SET count = count + excluded.count
+                    ''', [(granularity, start, kind, value, count) for value, count in bucket[kind].items()])
+                    # 只保留这个桶里最多的 N 项，长尾直接丢掉
+                    conn.execute('''
+                        DELETE FROM top_items WHERE granularity = ? AND start = ? AND kind = ? AND value NOT IN (
+                            SELECT value FROM top_items WHERE granularity = ? AND start = ? AND kind = ?
+                            ORDER BY count DESC LIMIT ?)
+                    ''', (granularity, start, kind, granularity, start, kind, ANALYTICS_TOP_N))
+            now = time.time()
+            for granularity, retention in ANALYTICS_RETENTION.items():
+                if retention is not None:
+                    conn.execute('DELETE FROM buckets WHERE granularity = ? AND start < ?',
+                                 (granularity, now - retention))
+                    conn.execute('DELETE FROM top_items WHERE granularity = ? AND start < ?',
+                                 (granularity, now - retention))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def query(self, start, end, granularity, top=10):
+        """查询 [start, end) 时间段：每个桶的访问量和独立 IP 数、整段的合计和最多的 UA/来源"""
+        conn = self._connect()
+        step = self.STEPS[granularity]
+        first = bucket_start(datetime.fromtimestamp(start), granularity)
+        series = []
+        total_visits = 0
+        total_unique = HyperLogLog()
+        rows = conn.execute(
+            'SELECT start, visits, unique_ips FROM buckets '
+            'WHERE granularity = ? AND start >= ? AND start < ? ORDER BY start',
+            (granularity, first, end))
+        for bucket, visits, registers in rows:
+            sketch = HyperLogLog(registers)
+            series.append({
+                'time': datetime.fromtimestamp(bucket).strftime('%Y-%m-%d %H:%M'),
+                'visits': visits,
+                'unique_visitors': sketch.count()
+            })
+            total_visits += visits
+            total_unique.merge(sketch.registers)
+        # 分钟桶不存 UA/来源，用所在的小时桶
+        top_granularity = 'hour' if granularity == 'minute' else granularity
+        top_first = bucket_start(datetime.fromtimestamp(start), top_granularity)
+        result = {
+            'start': datetime.fromtimestamp(first).strftime('%Y-%m-%d %H:%M'),
+            'end': datetime.fromtimestamp(end).strftime('%Y-%m-%d %H:%M'),
+            'granularity': granularity,
+            'step': step,
+            'visits': total_visits,
+            'unique_visitors': total_unique.count(),
+            'series': series
+        }
+        for kind, key in (('user_agent', 'top_user_agents'), ('referrer', 'top_referrers')):
+            rows = conn.execute(
+                'SELECT value, SUM(count) AS total FROM top_items '
+                'WHERE granularity = ? AND kind = ? AND start >= ? AND start < ? '
+                'GROUP BY value ORDER BY total DESC LIMIT ?',
+                (top_granularity, kind, top_first, end, top))
+            result[key] = [{'value': value, 'count': count} for value, count in rows]
+        return result
+
+
+class VisitCounter(BackgroundFlusher):
+    """首页访问统计的写缓冲
+
+    每个 worker 在内存中累计访问次数和访问记录，由后台线程定时（或攒够
+    flush_threshold 条时）在文件锁内合并进 stats.json，页面访问本身不写磁盘，
+    多个 worker 的计数也不会互相覆盖。
+    """
+
+    label = '写入访问统计'
+
+    def __init__(self, path, analytics=None, flush_interval=10, flush_threshold=50, max_logs=100):
+        super().__init__(flush_interval, flush_threshold)
+        self.path = path
+        self.analytics = analytics
+        self.max_logs = max_logs
+        self._file_lock = FileLock(path + '.lock')
+        self._visits = 0
+        self._last_visit = None
+        self._logs = []
+        self._rollup = {}
+
+    def record(self, visitor_log):
+        with self._lock:
+            if self.analytics is not None:
+                VisitAnalytics.rollup(self._rollup, visitor_log)
+            self._visits += 1
+            self._last_visit = visitor_log['timestamp']
+            self._logs.append(visitor_log)
+            if len(self._logs) > self.max_logs:
+                del self._logs[:-self.max_logs]
+            self._pending_changed(self._visits)
+
+    def flush(self):
+        self._flush_analytics()
+        with self._lock:
+            visits, last_visit, logs = self._visits, self._last_visit, self._logs
+            self._visits, self._last_visit, self._logs = 0, None, []
+        if not visits:
+            return
+        try:
+            with self._file_lock:
+                stats = load_stats()
+                stats['visits'] = stats.get('visits', 0) + visits
+                if not stats.get('last_visit') or last_visit > stats['last_visit']:
+                    stats['last_visit'] = last_visit
+                stats['visitor_logs'] = (stats.get('visitor_logs', []) + logs)[-self.max_logs:]
+                save_stats(stats)
+        except Exception:
+            # 写入失败时把计数放回去，下次再合并
+            with self._lock:
+                self._visits += visits
+                if self._last_visit is None or last_visit > self._last_visit:
+                    self._last_visit = last_visit
+                self._logs = (logs + self._logs)[-self.max_logs:]
+            raise
+
+    def _flush_analytics(self):
+        with self._lock:
+            rollup, self._rollup = self._rollup, {}
+        if not rollup:
+            return
+        try:
+            self.analytics.merge(rollup)
+        except Exception as e:
+            # 放回缓冲，下次再合并；不影响 stats.json 的写入
+            with self._lock:
+                VisitAnalytics.combine(rollup, self._rollup)
+                self._rollup = rollup
+            print(f'写入访问分析错误: {str(e)}')
+
+
+visit_analytics = VisitAnalytics(ANALYTICS_DB_FILE)
+visit_counter = VisitCounter(STATS_FILE, visit_analytics)
+atexit.register(visit_counter.flush)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -105,13 +1210,431 @@ def allowed_file(filename):
 def allowed_file_upload(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_FILE_EXTENSIONS
 
-def load_files():
-    with open(FILES_DB_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def save_files(files):
-    with open(FILES_DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump(files, f, ensure_ascii=False, indent=2)
+# 按内容寻址存储上传文件：文件名取内容的 sha256，相同内容只存一份
+def stage_upload(file, directory):
+    """边接收边计算哈希，写入 directory 下的临时文件；返回 (临时路径, 哈希, 大小)"""
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.part')
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, hasher.hexdigest()[:32], size
+
+def place_blob(tmp_path, path):
+    """把临时文件放到内容地址上；已有相同内容时丢弃临时文件，返回是否新建了文件"""
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+def save_upload(file, ext):
+    """保存图片等上传文件到 UPLOAD_FOLDER，返回按内容命名的文件名"""
+    tmp_path, digest, _ = stage_upload(file, app.config['UPLOAD_FOLDER'])
+    filename = f"{digest}.{ext}"
+    place_blob(tmp_path, os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    return filename
+
+# 文件资源的存储文件被多条目录记录共享，放置和删除都要在这个锁里进行
+blob_lock = FileLock('files.blobs.lock')
+
+# 文件列表分页：按 sort 字段排序，游标记录上一页最后一条的 (排序值, 序号)
+FILE_SORT_FIELDS = ('upload_date', 'downloads', 'size')
+
+def encode_cursor(value, seq):
+    return base64.urlsafe_b64encode(json.dumps([value, seq]).encode('utf-8')).decode('ascii').rstrip('=')
+
+def file_sort_key(file_info, sort):
+    default = '' if sort == 'upload_date' else 0
+    value = file_info.get(sort)
+    return (default if value is None else value, file_info['_seq'])
+
+def decode_cursor(cursor):
+    """无效的游标返回 None"""
+    try:
+        value, seq = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return value, int(seq)
+    except (ValueError, TypeError):
+        return None
+
+
+# 两种文件目录后端的公开方法都用 metrics.timer 记录耗时（operation="files_all" 等）
+class JsonFileCatalog:
+    """文件目录存在 files.json 里（整个数组读写）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file_lock = FileLock(path + '.lock')
+        self._index_lock = threading.Lock()  # 内存索引被多个请求线程共用
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        metrics.inc('storage_bytes_read_total', {'file': self.path}, len(raw))
+        started = time.perf_counter()
+        files = json.loads(raw)
+        metrics.observe('storage_parse_duration_seconds', {'file': self.path}, time.perf_counter() - started)
+        return files
+
+    def _save(self, files, content=True):
+        raw = json.dumps(files, ensure_ascii=False, indent=2).encode('utf-8')
+        atomic_write(self.path, raw)
+        metrics.inc('storage_bytes_written_total', {'file': self.path}, len(raw))
+        if content:
+            # 旁边的 .content 文件只在记录内容（不含下载次数）变化时重写，见 content_version()
+            atomic_write(self.path + '.content', uuid.uuid4().hex.encode('ascii'))
+
+    def version(self):
+        """目录的版本号，内容变化时改变（用于 ETag）"""
+        st = os.stat(self.path)
+        return f'{st.st_mtime_ns:x}-{st.st_ino:x}-{st.st_size:x}'
+
+    def content_version(self):
+        """除下载次数以外的内容的版本号（搜索索引用），只累加下载次数时不变"""
+        try:
+            st = os.stat(self.path + '.content')
+        except FileNotFoundError:
+            return self.version()  # 还没有通过本程序写过（旧数据或手工编辑）
+        return f'{st.st_mtime_ns:x}-{st.st_ino:x}'
+
+    @metrics.timer('files_all')
+    def all(self):
+        return self._load()
+
+    @metrics.timer('files_get')
+    def get(self, file_id):
+        return next((f for f in self._load() if f['id'] == file_id), None)
+
+    @metrics.timer('files_add')
+    def add_many(self, file_infos):
+        with self._file_lock:
+            self._save(self._load() + list(file_infos))
+
+    def _sorted_index(self, folder, file_type, sort):
+        """内存索引：按 (筛选条件, 排序字段) 缓存有序列表，目录版本变化后重建（持有 self._index_lock）"""
+        version = self.version()
+        if getattr(self, '_index_version', None) != version:
+            self._files = self._load()
+            for seq, file_info in enumerate(self._files):
+                file_info['_seq'] = seq
+            self._index = {}
+            self._index_version = version
+        key = (folder, file_type, sort)
+        if key not in self._index:
+            matched = sorted(
+                (file_sort_key(f, sort), f) for f in self._files
+                if (folder is None or f.get('folder') == folder)
+                and (file_type is None or f.get('type') == file_type))
+            self._index[key] = ([k for k, _ in matched], [f for _, f in matched])
+        return self._index[key]
+
+    @metrics.timer('files_page')
+    def page(self, folder=None, file_type=None, sort='upload_date', descending=True, cursor=None, limit=50):
+        """返回 (本页文件, 下一页游标, 符合条件的总数)；总数只在第一页（没有游标时）返回，之后为 None"""
+        with self._index_lock:
+            keys, ordered = self._sorted_index(folder, file_type, sort)
+            if descending:
+                end = len(keys) if cursor is None else bisect.bisect_left(keys, tuple(cursor))
+                items = ordered[max(end - limit, 0):end][::-1]
+                has_more = end - limit > 0
+            else:
+                start = 0 if cursor is None else bisect.bisect_right(keys, tuple(cursor))
+                items = ordered[start:start + limit]
+                has_more = start + limit < len(keys)
+            total = len(keys) if cursor is None else None
+        next_cursor = None
+        if has_more and items:
+            next_cursor = encode_cursor(*file_sort_key(items[-1], sort))
+        return [{k: v for k, v in f.items() if k != '_seq'} for f in items], next_cursor, total
+
+    @metrics.timer('files_delete')
+    def delete(self, file_id):
+        with self._file_lock:
+            files = self._load()
+            remaining = [f for f in files if f['id'] != file_id]
+            if len(remaining) == len(files):
+                return False
+            self._save(remaining)
+            return True
+
+    def exists(self, file_id):
+        return self.get(file_id) is not None
+
+    def count_references(self, relative_path):
+        """引用同一个存储文件的记录数"""
+        return sum(1 for f in self._load() if (f.get('relative_path') or f['filename']) == relative_path)
+
+    @metrics.timer('files_add_downloads')
+    def add_downloads(self, counts):
+        """批量累加下载次数，counts 是 {文件id: 增量}"""
+        with self._file_lock:
+            files = self._load()
+            for file_info in files:
+                if file_info['id'] in counts:
+                    file_info['downloads'] = file_info.get('downloads', 0) + counts[file_info['id']]
+            self._save(files, content=False)
+
+    @metrics.timer('files_replace_all')
+    def replace_all(self, files):
+        with self._file_lock:
+            self._save(files)
+
+
+class SqliteFileCatalog:
+    """文件目录存在 SQLite 里（WAL 模式），按 id/folder/type/upload_date 建索引
+
+    每个线程一个连接；第一次打开时把旧的 files.json 一次性导入。
+    """
+
+    COLUMNS = ('id', 'original_name', 'filename', 'relative_path', 'folder',
+               'description', 'size', 'upload_date', 'type', 'downloads')
+
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self._local = threading.local()
+        self._init_lock = FileLock(path + '.lock')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # gunicorn fork 之后不能沿用父进程的连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # 切换 WAL 和建表在多个 worker 同时首次打开时会报 database is locked，串行执行
+            with self._init_lock:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                self._init_schema(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                original_name TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                relative_path TEXT,
+                folder TEXT,
+                description TEXT,
+                size INTEGER NOT NULL DEFAULT 0,
+                upload_date TEXT,
+                type TEXT,
+                downloads INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_folder ON files(folder);
+            CREATE INDEX IF NOT EXISTS idx_files_type ON files(type);
+            CREATE INDEX IF NOT EXISTS idx_files_upload_date ON files(upload_date);
+            CREATE INDEX IF NOT EXISTS idx_files_relative_path ON files(relative_path);
+            CREATE INDEX IF NOT EXISTS idx_files_downloads ON files(downloads);
+            CREATE INDEX IF NOT EXISTS idx_files_size ON files(size);
+            CREATE INDEX IF NOT EXISTS idx_files_folder_upload_date ON files(folder, upload_date);
+            CREATE INDEX IF NOT EXISTS idx_files_type_upload_date ON files(type, upload_date);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0');
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('content_version', '0');
+        ''')
+        # 数据库实例id：重新部署后新建的数据库版本号从头计数，靠它区分
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('instance', ?)", (uuid.uuid4().hex[:8],))
+        # 只有还没导入过才开写事务，否则每个新连接都会让版本号加一
+        migrated_query = "SELECT value FROM meta WHERE key = 'json_migrated'"
+        if conn.execute(migrated_query).fetchone() is None:
+            with self._transaction(conn):
+                if conn.execute(migrated_query).fetchone() is None:
+                    if self.legacy_json_path and os.path.exists(self.legacy_json_path):
+                        with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+                            self._insert(conn, json.load(f))
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                                 (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),))
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn, content=True):
+        # BEGIN IMMEDIATE：一开始就拿写锁，多个 worker 同时写时排队而不是死锁
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            # 每次写入都递增版本号，和修改在同一个事务里；只改下载次数时（content=False）内容版本号不变
+            keys = ('version', 'content_version') if content else ('version',)
+            conn.execute(f"UPDATE meta SET value = CAST(value AS INTEGER) + 1 "
+                         f"WHERE key IN ({', '.join('?' * len(keys))})", keys)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def version(self):
+        """目录的版本号，内容变化时改变（用于 ETag）"""
+        rows = self._connect().execute(
+            "SELECT value FROM meta WHERE key IN ('instance', 'version') ORDER BY key")
+        return '-'.join(row[0] for row in rows)
+
+    def content_version(self):
+        """除下载次数以外的内容的版本号（搜索索引用），只累加下载次数时不变"""
+        rows = self._connect().execute(
+            "SELECT value FROM meta WHERE key IN ('content_version', 'instance') ORDER BY key")
+        return '-'.join(row[0] for row in rows)
+
+    def _insert(self, conn, file_infos):
+        conn.executemany(
+            f"INSERT OR REPLACE INTO files ({', '.join(self.COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+            [tuple(f.get(col) if f.get(col) is not None else self._default(col) for col in self.COLUMNS)
+             for f in file_infos])
+
+    @staticmethod
+    def _default(column):
+        # 排序字段不存 NULL，保证分页比较正确
+        if column in ('size', 'downloads'):
+            return 0
+        if column == 'upload_date':
+            return ''
+        return None
+
+    @metrics.timer('files_all')
+    def all(self):
+        rows = self._connect().execute('SELECT * FROM files ORDER BY rowid')
+        return [dict(row) for row in rows]
+
+    @metrics.timer('files_get')
+    def get(self, file_id):
+        row = self._connect().execute('SELECT * FROM files WHERE id = ?', (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    @metrics.timer('files_page')
+    def page(self, folder=None, file_type=None, sort='upload_date', descending=True, cursor=None, limit=50):
+        """返回 (本页文件, 下一页游标, 符合条件的总数)
+
+        按 (排序字段, rowid) 做键集分页，每页都直接走索引，不随翻页深度变慢；
+        总数要数一遍符合条件的行，只在第一页（没有游标时）返回，之后为 None。
+        """
+        conditions, params = [], []
+        if folder is not None:
+            conditions.append('folder = ?')
+            params.append(folder)
+        if file_type is not None:
+            conditions.append('type = ?')
+            params.append(file_type)
+        where = ' AND '.join(conditions) or '1'
+        conn = self._connect()
+        total = None
+        if cursor is None:
+            total = conn.execute(f'SELECT COUNT(*) FROM files WHERE {where}', params).fetchone()[0]
+
+        op = '<' if descending else '>'
+        direction = 'DESC' if descending else 'ASC'
+        if cursor is not None:
+            conditions.append(f'({sort} {op} ? OR ({sort} = ? AND rowid {op} ?))')
+            params += [cursor[0], cursor[0], cursor[1]]
+        rows = conn.execute(
+            f"SELECT rowid AS _seq, * FROM files WHERE {' AND '.join(conditions) or '1'} "
+            f'ORDER BY {sort} {direction}, rowid {direction} LIMIT ?', params + [limit + 1]).fetchall()
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(items[-1][sort], items[-1]['_seq'])
+        for item in items:
+            del item['_seq']
+        return items, next_cursor, total
+
+    @metrics.timer('files_add')
+    def add_many(self, file_infos):
+        conn = self._connect()
+        with self._transaction(conn):
+            self._insert(conn, file_infos)
+
+    @metrics.timer('files_delete')
+    def delete(self, file_id):
+        conn = self._connect()
+        with self._transaction(conn):
+            return conn.execute('DELETE FROM files WHERE id = ?', (file_id,)).rowcount > 0
+
+    def exists(self, file_id):
+        return self._connect().execute('SELECT 1 FROM files WHERE id = ?', (file_id,)).fetchone() is not None
+
+    def count_references(self, relative_path):
+        """引用同一个存储文件的记录数"""
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM files WHERE relative_path = ?', (relative_path,)).fetchone()[0]
+
+    @metrics.timer('files_add_downloads')
+    def add_downloads(self, counts):
+        """批量累加下载次数，counts 是 {文件id: 增量}"""
+        conn = self._connect()
+        with self._transaction(conn, content=False):
+            conn.executemany('UPDATE files SET downloads = downloads + ? WHERE id = ?',
+                             [(count, file_id) for file_id, count in counts.items()])
+
+    @metrics.timer('files_replace_all')
+    def replace_all(self, files):
+        conn = self._connect()
+        with self._transaction(conn):
+            conn.execute('DELETE FROM files')
+            self._insert(conn, files)
+
+
+if FILES_BACKEND == 'json':
+    files_catalog = JsonFileCatalog(FILES_DB_FILE)
+else:
+    files_catalog = SqliteFileCatalog(FILES_SQLITE_FILE, legacy_json_path=FILES_DB_FILE)
+
+
+class DownloadCounter(BackgroundFlusher):
+    """下载次数的写缓冲
+
+    下载计数先按文件 id 累计在内存里，由后台线程定时（或攒够 flush_threshold
+    次时）批量写入文件目录，每次点击下载不再改写整个目录。
+    """
+
+    label = '写入下载次数'
+
+    def __init__(self, catalog, flush_interval=10, flush_threshold=100):
+        super().__init__(flush_interval, flush_threshold)
+        self.catalog = catalog
+        self._counts = {}
+        self._total = 0
+
+    def add(self, file_id):
+        with self._lock:
+            self._counts[file_id] = self._counts.get(file_id, 0) + 1
+            self._total += 1
+            self._pending_changed(self._total)
+
+    def pending(self):
+        """尚未写入目录的增量"""
+        with self._lock:
+            return dict(self._counts)
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts, self._total = self._counts, {}, 0
+        if not counts:
+            return
+        try:
+            self.catalog.add_downloads(counts)
+        except Exception:
+            # 写入失败时把增量放回去，下次再写
+            with self._lock:
+                for file_id, count in counts.items():
+                    self._counts[file_id] = self._counts.get(file_id, 0) + count
+                    self._total += count
+            raise
+
+
+download_counter = DownloadCounter(files_catalog)
+atexit.register(download_counter.flush)
 
 # 登录验证装饰器
 def login_required(f):
@@ -122,14 +1645,340 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# 条件请求：按数据版本生成 ETag，客户端缓存仍然有效时直接返回 304，不读取也不序列化数据
+def etag_conditional(get_etag):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag = get_etag()
+            matched = etag_matches(request.if_none_match, etag)
+            if matched:
+                response = app.response_class(status=304)
+                response.set_etag(matched)
+                response.vary.add('Accept-Encoding')
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            # 允许浏览器和CDN缓存，但每次使用前都要用 If-None-Match 重新验证
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+# 压缩：静态资源启动时预先压缩好，动态内容按版本压缩一次后复用
+def preferred_encoding():
+    """客户端支持的最佳压缩方式：br > gzip，都不支持时返回 None"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(raw, encoding):
+    if encoding == 'br':
+        return brotli.compress(raw)
+    return gzip.compress(raw, compresslevel=6, mtime=0)
+
+def is_user_content(path):
+    """路径在上传目录（static/uploads、static/files）里：用户文件会被删除和替换，不生成压缩版本"""
+    path = os.path.abspath(path)
+    return any(path.startswith(os.path.abspath(folder) + os.sep) for folder in (UPLOAD_FOLDER, FILES_FOLDER))
+
+def static_variant(filename, encoding):
+    """返回静态文件压缩版本的路径，源文件变化后重新生成；上传的用户文件返回 None"""
+    source = safe_join(app.static_folder, filename)
+    if source is None or not os.path.isfile(source) or is_user_content(source):
+        return None
+    suffix = '.br' if encoding == 'br' else '.gz'
+    variant = os.path.join(CACHE_FOLDER, 'static', filename + suffix)
+    source_mtime = os.stat(source).st_mtime_ns
+    try:
+        if os.stat(variant).st_mtime_ns == source_mtime:
+            return variant
+    except FileNotFoundError:
+        pass
+    with open(source, 'rb') as f:
+        raw = f.read()
+    os.makedirs(os.path.dirname(variant), exist_ok=True)
+    atomic_write(variant, compress_body(raw, encoding))
+    # 压缩版本的修改时间和源文件保持一致，用来判断是否过期
+    os.utime(variant, ns=(source_mtime, source_mtime))
+    return variant
+
+# 资源构建：static/js、static/css 压缩后按内容哈希命名写到 static/build，
+# 模板里用 asset_url('js/main.js') 通过 manifest 找到当前版本
+_asset_manifest = {}
+
+def minify_css(text):
+    """去掉注释和多余空白，字符串原样保留"""
+    def replace(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        if match.group(2) is not None:
+            return match.group(2)
+        return '' if match.group(0).startswith('/*') else ' '
+    pattern = r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|\s*([{};,])\s*|/\*.*?\*/|\s+'
+    return re.sub(pattern, replace, text, flags=re.S).strip()
+
+def minify_asset(filename, raw):
+    if filename.endswith('.css'):
+        return minify_css(raw.decode('utf-8')).encode('utf-8')
+    if filename.endswith('.js') and rjsmin is not None:
+        return rjsmin.jsmin(raw.decode('utf-8')).encode('utf-8')
+    return raw
+
+def build_assets():
+    """构建 css/js 并写入 manifest，返回 {逻辑名: 构建后相对 static 的路径}
+
+    manifest.json 是 {assets: 当前版本, previous: 上一版本的文件}，只有内容变化时才轮换；
+    只保留这两个版本的文件，已经打开的旧页面仍然能加载到资源。
+    """
+    global _asset_manifest
+    build_folder = os.path.join(app.static_folder, ASSET_BUILD_FOLDER)
+    manifest_path = os.path.join(build_folder, 'manifest.json')
+    os.makedirs(build_folder, exist_ok=True)
+    with FileLock(manifest_path + '.lock'):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            saved = {}
+        # 旧版本的 manifest 只有 {逻辑名: 路径}
+        current = saved['assets'] if 'assets' in saved else saved
+        manifest = {}
+        for pattern in ASSET_SOURCES:
+            for source in sorted(glob.glob(os.path.join(app.static_folder, pattern))):
+                name = os.path.relpath(source, app.static_folder).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    raw = minify_asset(name, f.read())
+                stem, ext = os.path.splitext(name)
+                built = f'{ASSET_BUILD_FOLDER}/{stem}.{hashlib.sha256(raw).hexdigest()[:10]}{ext}'
+                dest = os.path.join(app.static_folder, built)
+                if not os.path.exists(dest):
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    atomic_write(dest, raw)
+                manifest[name] = built
+        previous = saved.get('previous', [])
+        if manifest != current:
+            previous = sorted(set(current.values()) - set(manifest.values()))
+            atomic_write(manifest_path, json.dumps({'assets': manifest, 'previous': previous},
+                                                   indent=2).encode('utf-8'))
+        keep = {os.path.abspath(os.path.join(app.static_folder, p)) for p in (*manifest.values(), *previous)}
+        for root, _, filenames in os.walk(build_folder):
+            for filename in filenames:
+                path = os.path.abspath(os.path.join(root, filename))
+                if not filename.startswith('manifest.json') and path not in keep:
+                    os.remove(path)
+    _asset_manifest = manifest
+    return manifest
+
+# 页面据此决定是否订阅 /api/events
+app.jinja_env.globals['live_updates'] = SSE_ENABLED
+
+@app.template_global()
+def asset_url(name):
+    """模板里引用 css/js：返回构建后带内容哈希的地址，没有构建时退回原文件"""
+    return '/static/' + _asset_manifest.get(name, name)
+
+def precompress_static():
+    """启动时压缩所有静态资源（上传的用户文件除外）"""
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+    skip = {os.path.abspath(UPLOAD_FOLDER), os.path.abspath(FILES_FOLDER)}
+    for root, dirs, filenames in os.walk(app.static_folder):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in skip]
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                filename = os.path.relpath(os.path.join(root, name), app.static_folder).replace(os.sep, '/')
+                for encoding in encodings:
+                    try:
+                        static_variant(filename, encoding)
+                    except OSError as e:
+                        print(f'压缩静态文件失败 {filename}: {str(e)}')
+
+# 图片缩略图：在进程池里生成（见 image_derivatives.py），按源文件内容哈希和宽度缓存在 .cache/derivatives
+DERIVATIVES_FOLDER = os.path.join(CACHE_FOLDER, 'derivatives')
+_derivative_pool = None
+_derivative_pool_lock = threading.Lock()
+_derivative_pending = set()
+_source_hashes = {}  # (路径, mtime, size) -> 内容哈希
+
+def image_source_hash(path):
+    """按内容命名的上传文件直接用文件名，其他文件（如 avatar.png）计算哈希"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if re.fullmatch(r'[0-9a-f]{32}', stem):
+        return stem
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key not in _source_hashes:
+        with open(path, 'rb') as f:
+            _source_hashes[key] = hashlib.sha256(f.read()).hexdigest()[:32]
+    return _source_hashes[key]
+
+def derivative_targets(path):
+    ext = path.rsplit('.', 1)[1].lower()
+    source_hash = image_source_hash(path)
+    targets = {}
+    for width in DERIVATIVE_WIDTHS:
+        for suffix, fmt in (('webp', 'WEBP'), (ext, 'JPEG' if ext in ('jpg', 'jpeg') else ext.upper())):
+            dest = os.path.join(DERIVATIVES_FOLDER, f'{source_hash}_{width}.{suffix}')
+            targets[dest] = (width, dest, fmt)
+    return list(targets.values())
+
+def schedule_image_derivatives(path):
+    """上传图片后在后台进程池里生成缩略图，不阻塞请求"""
+    global _derivative_pool
+    if Image is None or '.' not in path or path.rsplit('.', 1)[1].lower() not in DERIVATIVE_EXTENSIONS:
+        return
+    targets = [t for t in derivative_targets(path) if not os.path.exists(t[1])]
+    if not targets or path in _derivative_pending:
+        return
+    os.makedirs(DERIVATIVES_FOLDER, exist_ok=True)
+    with _derivative_pool_lock:
+        if _derivative_pool is None:
+            # 不能直接 fork：这时进程里已经有后台线程在运行，它们持有的锁会原样留在子进程里。
+            # forkserver 从一个干净的进程 fork 出子进程，子进程只导入 image_derivatives（和主模块，
+            # gunicorn 下是 gunicorn 自己的入口脚本）
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            if 'forkserver' in methods:
+                context.set_forkserver_preload(['image_derivatives'])
+            _derivative_pool = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS, mp_context=context)
+        _derivative_pending.add(path)
+        try:
+            future = _derivative_pool.submit(build_image_derivatives, path, targets)
+        except BrokenProcessPool as e:
+            # 子进程异常退出后进程池不能再用，下次重新创建
+            print(f'生成缩略图失败 {path}: {str(e)}')
+            _derivative_pending.discard(path)
+            _derivative_pool = None
+            return
+
+    def done(future):
+        _derivative_pending.discard(path)
+        if future.exception():
+            print(f'生成缩略图失败 {path}: {str(future.exception())}')
+
+    future.add_done_callback(done)
+
+def serve_image_derivative(filename, requested_width):
+    """返回最接近请求宽度的缩略图响应；还没生成时安排生成并返回 None（先用原图）"""
+    source = safe_join(app.static_folder, filename)
+    if source is None or not os.path.isfile(source) or Image is None:
+        return None
+    ext = filename.rsplit('.', 1)[1].lower()
+    if ext not in DERIVATIVE_EXTENSIONS:
+        return None
+    width = next((w for w in DERIVATIVE_WIDTHS if w >= requested_width), DERIVATIVE_WIDTHS[-1])
+    suffix = 'webp' if 'image/webp' in request.headers.get('Accept', '') else ext
+    derivative = os.path.join(DERIVATIVES_FOLDER, f'{image_source_hash(source)}_{width}.{suffix}')
+    if not os.path.exists(derivative):
+        schedule_image_derivatives(source)
+        return None
+    response = send_file(os.path.abspath(derivative), mimetype=mimetypes.guess_type(derivative)[0],
+                         max_age=app.get_send_file_max_age(filename))
+    response.vary.add('Accept')
+    return response
+
+def is_hidden_path(filename):
+    """路径里有以 . 开头的部分（如 files/.uploads 下未完成的上传）"""
+    return any(part.startswith('.') for part in filename.replace('\\', '/').split('/'))
+
+def serve_static(filename):
+    """静态文件：客户端支持时直接发送预先压缩好的版本；上传的图片可以用 ?w= 取缩略图"""
+    if is_hidden_path(filename):
+        abort(404)
+    if filename.startswith('uploads/') and request.args.get('w', type=int):
+        response = serve_image_derivative(filename, request.args.get('w', type=int))
+        if response is not None:
+            return response
+
+    response = None
+    encoding = None
+    if os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        encoding = preferred_encoding()
+    if encoding:
+        variant = static_variant(filename, encoding)
+        if variant:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_file(os.path.abspath(variant), mimetype=mimetype,
+                                 max_age=app.get_send_file_max_age(filename))
+            response.headers['Content-Encoding'] = encoding
+    if response is None:
+        response = app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+    if filename.startswith(ASSET_BUILD_FOLDER + '/') and response.status_code in (200, 304):
+        # 内容变化时文件名也会变，同一个地址永远不用重新验证
+        response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
+app.view_functions['static'] = serve_static
+
+_compressed_responses = {}
+_COMPRESSED_RESPONSES_MAX = 128
+_compressed_responses_lock = threading.Lock()  # gthread worker 的多个线程共用这个缓存
+
+@app.after_request
+def compress_response(response):
+    """压缩带 ETag 的 JSON 响应；同一路径同一版本只压缩一次"""
+    if (response.mimetype != 'application/json' or response.status_code != 200
+            or response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    etag, _ = response.get_etag()
+    encoding = preferred_encoding()
+    content_length = response.content_length
+    if not etag or not encoding or content_length is None or content_length < COMPRESS_MIN_SIZE:
+        return response
+    key = (request.full_path, etag, encoding)
+    with _compressed_responses_lock:
+        body = _compressed_responses.get(key)
+    if body is None:
+        # 压缩放在锁外面，两个线程同时压缩同一个响应也只是多做一次
+        body = compress_body(response.get_data(), encoding)
+        with _compressed_responses_lock:
+            if len(_compressed_responses) >= _COMPRESSED_RESPONSES_MAX:
+                _compressed_responses.pop(next(iter(_compressed_responses)), None)
+            _compressed_responses[key] = body
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # 不同压缩方式是不同的表示，ETag 也要区分
+    response.set_etag(f'{etag}-{encoding}')
+    return response
+
+def render_cached_page(template_name):
+    """按数据版本缓存渲染好的页面和它的压缩版本，数据保存后自动重新渲染"""
+    def build(doc):
+        with metrics.timer('render_template'):
+            # 页面会把 data 内联到 window.pageData，不能带上密码
+            data = {k: v for k, v in doc.items() if k != 'admin_password'}
+            return {None: render_template(template_name, data=data).encode('utf-8')}
+
+    variants = data_store.derived(f'page:{template_name}', build)
+    encoding = preferred_encoding()
+    if encoding not in variants:
+        variants[encoding] = compress_body(variants[None], encoding)
+    response = app.response_class(variants[encoding], mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def data_etag():
+    data_store.read()
+    return data_store.etag
+
+def files_etag():
+    pending = download_counter.pending()
+    if not pending:
+        return f'files-{files_catalog.version()}'
+    digest = hashlib.sha1(repr(sorted(pending.items())).encode('utf-8')).hexdigest()[:16]
+    return f'files-{files_catalog.version()}-{digest}'
+
 # 路由
 @app.route('/')
 def index():
-    # 记录访问
-    stats = load_stats()
-    stats['visits'] += 1
-    stats['last_visit'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
     # 记录访问者IP
     visitor_ip = request.headers.get('X-Forwarded-For', request.remote_addr)
     # 处理多个IP的情况（代理链）
@@ -139,20 +1988,14 @@ def index():
     visitor_log = {
         'ip': visitor_ip,
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'user_agent': request.headers.get('User-Agent', 'Unknown')
+        'user_agent': request.headers.get('User-Agent', 'Unknown'),
+        'referrer': request.referrer
     }
 
-    # 保留最近100条访问记录
-    if 'visitor_logs' not in stats:
-        stats['visitor_logs'] = []
-    stats['visitor_logs'].append(visitor_log)
-    if len(stats['visitor_logs']) > 100:
-        stats['visitor_logs'] = stats['visitor_logs'][-100:]
-
-    save_stats(stats)
+    # 记录访问（写缓冲，后台合并进stats.json，保留最近100条访问记录）
+    visit_counter.record(visitor_log)
 
-    data = load_data()
-    return render_template('index.html', data=data)
+    return render_cached_page('index.html')
 
 # 微信验证文件路由
 @app.route('/3d773b4521c4a89f973f6b7d851a9edc.txt')
@@ -162,14 +2005,14 @@ def wechat_verification():
 @app.route('/admin')
 def admin():
     if 'logged_in' not in session:
-        return render_template('login.html')
-    data = load_data()
-    stats = load_stats()
-    return render_template('admin.html', data=data, stats=stats)
+        with metrics.timer('render_template'):
+            return render_template('login.html')
+    # 统计数据由 admin.js 通过 /api/stats 加载，页面本身只依赖 data
+    return render_cached_page('admin.html')
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    data = load_data()
+    data = read_data()
     password = request.json.get('password')
     
     if password == data['admin_password']:
@@ -184,34 +2027,186 @@ def logout():
     return jsonify({'success': True, 'message': '已登出'})
 
 @app.route('/api/data', methods=['GET'])
+@etag_conditional(data_etag)
 def get_data():
-    data = load_data()
     # 不返回密码
-    if 'admin_password' in data:
-        del data['admin_password']
-    return jsonify(data)
+    return jsonify(public_data())
 
 @app.route('/api/data', methods=['POST'])
 @login_required
 def update_data():
-    """更新整个data对象（用于按钮管理等）"""
+    """更新整个data对象（用于按钮管理等）；带 If-Match 时版本不符返回 412"""
     try:
         new_data = request.json
         
         if not new_data:
             return jsonify({'success': False, 'message': '没有数据'}), 400
         
-        # 保留密码
-        old_data = load_data()
-        if 'admin_password' in old_data:
-            new_data['admin_password'] = old_data['admin_password']
-        
-        save_data(new_data)
-        return jsonify({'success': True, 'message': '数据已更新'})
+        def replace(old_data):
+            # 保留密码
+            if 'admin_password' in old_data:
+                new_data['admin_password'] = old_data['admin_password']
+            return new_data
+
+        etag = data_store.apply(replace, request.if_match)
+        response = jsonify({'success': True, 'message': '数据已更新'})
+        response.set_etag(etag)
+        return response
+    except DocumentConflict as e:
+        return data_conflict_response(e.etag)
     except Exception as e:
         print(f'更新data错误: {str(e)}')
         return jsonify({'success': False, 'message': f'更新失败: {str(e)}'}), 500
 
+def data_conflict_response(etag):
+    response = jsonify({'success': False, 'message': '数据已被修改，请刷新后重试'})
+    response.status_code = 412
+    response.set_etag(etag)
+    return response
+
+# JSON Patch（RFC 6902）：只提交修改的路径
+class JsonPatchError(ValueError):
+    pass
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    pass
+
+
+def _pointer_tokens(pointer):
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise JsonPatchError(f'无效的路径: {pointer}')
+    if pointer == '':
+        return []
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+def _array_index(array, token, allow_end=False):
+    if allow_end and token == '-':
+        return len(array)
+    if not re.fullmatch(r'0|[1-9][0-9]*', token):
+        raise JsonPatchError(f'无效的数组下标: {token}')
+    index = int(token)
+    if index > len(array) or (index == len(array) and not allow_end):
+        raise JsonPatchError(f'数组下标越界: {token}')
+    return index
+
+def _pointer_get(doc, tokens):
+    for token in tokens:
+        if isinstance(doc, list):
+            doc = doc[_array_index(doc, token)]
+        elif isinstance(doc, dict) and token in doc:
+            doc = doc[token]
+        else:
+            raise JsonPatchError(f"路径不存在: /{'/'.join(tokens)}")
+    return doc
+
+def _patch_add(doc, tokens, value):
+    if not tokens:
+        return value
+    parent = _pointer_get(doc, tokens[:-1])
+    if isinstance(parent, list):
+        parent.insert(_array_index(parent, tokens[-1], allow_end=True), value)
+    elif isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    else:
+        raise JsonPatchError(f"路径不存在: /{'/'.join(tokens)}")
+    return doc
+
+def _patch_remove(doc, tokens):
+    if not tokens:
+        raise JsonPatchError('不能删除整个文档')
+    parent = _pointer_get(doc, tokens[:-1])
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, tokens[-1]))
+    if isinstance(parent, dict) and tokens[-1] in parent:
+        return parent.pop(tokens[-1])
+    raise JsonPatchError(f"路径不存在: /{'/'.join(tokens)}")
+
+def _json_equal(a, b):
+    """RFC 6902 test 的相等：数字按数值比较（1 == 1.0），但布尔值不等于数字"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+def apply_json_patch(doc, patch):
+    """按顺序执行补丁操作（add/remove/replace/move/copy/test），返回新文档；失败时抛出 JsonPatchError"""
+    if not isinstance(patch, list):
+        raise JsonPatchError('补丁必须是操作数组')
+    for operation in patch:
+        if not isinstance(operation, dict) or 'path' not in operation:
+            raise JsonPatchError('无效的补丁操作')
+        op = operation.get('op')
+        tokens = _pointer_tokens(operation['path'])
+        if op in ('add', 'replace', 'test') and 'value' not in operation:
+            raise JsonPatchError(f'{op} 操作缺少 value')
+        if op == 'add':
+            doc = _patch_add(doc, tokens, operation['value'])
+        elif op == 'remove':
+            _patch_remove(doc, tokens)
+        elif op == 'replace':
+            _pointer_get(doc, tokens)
+            if tokens:
+                _patch_remove(doc, tokens)
+            doc = _patch_add(doc, tokens, operation['value'])
+        elif op in ('move', 'copy'):
+            source = _pointer_tokens(operation.get('from'))
+            if op == 'move':
+                if tokens[:len(source)] == source and tokens != source:
+                    raise JsonPatchError('不能把节点移动到它自己的子节点下')
+                value = _patch_remove(doc, source) if source else doc
+            else:
+                value = json.loads(json.dumps(_pointer_get(doc, source)))
+            doc = _patch_add(doc, tokens, value)
+        elif op == 'test':
+            if not _json_equal(_pointer_get(doc, tokens), operation['value']):
+                raise JsonPatchTestFailed(f"test 失败: {operation['path']}")
+        else:
+            raise JsonPatchError(f'不支持的操作: {op}')
+    return doc
+
+@app.route('/api/data', methods=['PATCH'])
+@login_required
+def patch_data():
+    """用 JSON Patch 局部修改数据
+
+    请求体是 RFC 6902 操作数组；带 If-Match（/api/data 或 /data.json 返回的 ETag）
+    时，文档在此期间被修改过就返回 412，不做任何修改。密码不能通过补丁修改。
+    """
+    patch = request.get_json(force=True, silent=True)
+    try:
+        if not isinstance(patch, list):
+            raise JsonPatchError('补丁必须是操作数组')
+        for operation in patch:
+            pointers = [operation.get('path'), operation.get('from')] if isinstance(operation, dict) else []
+            if any(isinstance(p, str) and _pointer_tokens(p)[:1] == ['admin_password'] for p in pointers):
+                return jsonify({'success': False, 'message': '不能通过补丁修改密码'}), 403
+
+        def mutate(doc):
+            password = doc.pop('admin_password', None)
+            doc = apply_json_patch(doc, patch)
+            if not isinstance(doc, dict):
+                raise JsonPatchError('文档必须是对象')
+            if password is not None:
+                doc['admin_password'] = password
+            return doc
+
+        etag = data_store.apply(mutate, request.if_match)
+    except DocumentConflict as e:
+        return data_conflict_response(e.etag)
+    except JsonPatchTestFailed as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except JsonPatchError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    response = jsonify({'success': True, 'message': '数据已更新'})
+    response.set_etag(etag)
+    return response
+
 @app.route('/api/profile', methods=['POST'])
 @login_required
 def update_profile():
@@ -255,8 +2250,9 @@ def update_skills():
     return jsonify({'success': True, 'message': '技能已更新'})
 
 @app.route('/api/projects', methods=['GET'])
+@etag_conditional(data_etag)
 def get_projects():
-    data = load_data()
+    data = read_data()
     return jsonify(data.get('projects', []))
 
 @app.route('/api/projects', methods=['POST'])
@@ -303,12 +2299,10 @@ def upload_file():
         return jsonify({'success': False, 'message': '没有选择文件'}), 400
     
     if file and allowed_file(file.filename):
-        # 生成唯一文件名
+        # 按内容命名，重复上传同一张图片不会多占空间
         ext = file.filename.rsplit('.', 1)[1].lower()
-        filename = f"{uuid.uuid4().hex}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        file.save(filepath)
+        filename = save_upload(file, ext)
+        schedule_image_derivatives(os.path.join(app.config['UPLOAD_FOLDER'], filename))
         file_url = f"/static/uploads/{filename}"
         
         return jsonify({
@@ -322,8 +2316,53 @@ def upload_file():
 @app.route('/api/stats', methods=['GET'])
 @login_required
 def get_stats():
-    stats = load_stats()
-    return jsonify(stats)
+    """访问统计
+
+    带 start/end/granularity 任一参数时查询访问分析：start、end 可以是时间戳或
+    '2025-01-01 08:00' 这样的时间（默认最近24小时），granularity 为
+    minute/hour/day（默认按时间段长度自动选择），top 为返回的 UA/来源条数。
+    """
+    visit_counter.flush()
+    if not any(key in request.args for key in ('start', 'end', 'granularity')):
+        return jsonify(load_stats())
+
+    try:
+        end = parse_stats_time(request.args.get('end'))
+        if end is None:
+            end = time.time()
+        start = parse_stats_time(request.args.get('start'))
+        if start is None:
+            start = end - 24 * 60 * 60
+    except ValueError:
+        return jsonify({'success': False, 'message': '无效的时间参数'}), 400
+    if start >= end:
+        return jsonify({'success': False, 'message': '开始时间必须早于结束时间'}), 400
+    granularity = request.args.get('granularity')
+    if granularity is None:
+        span = end - start
+        granularity = 'minute' if span <= 6 * 60 * 60 else 'hour' if span <= 7 * 24 * 60 * 60 else 'day'
+    if granularity not in VisitAnalytics.GRANULARITIES:
+        return jsonify({'success': False, 'message': '不支持的时间粒度'}), 400
+    if (end - start) / VisitAnalytics.STEPS[granularity] > ANALYTICS_MAX_POINTS:
+        return jsonify({'success': False, 'message': '时间范围太大，请使用更粗的粒度'}), 400
+    top = min(max(request.args.get('top', 10, type=int), 1), ANALYTICS_TOP_N)
+    return jsonify(visit_analytics.query(start, end, granularity, top))
+
+def parse_stats_time(value):
+    """时间戳或 ISO 格式的时间，返回秒；空值返回 None，无效的值（nan、inf、超出范围）抛出 ValueError"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+    if not math.isfinite(seconds):
+        raise ValueError(f'无效的时间: {value}')
+    try:
+        datetime.fromtimestamp(seconds)
+    except (OverflowError, OSError) as e:
+        raise ValueError(f'无效的时间: {value}') from e
+    return seconds
 
 @app.route('/api/password', methods=['POST'])
 @login_required
@@ -345,10 +2384,93 @@ def change_password():
 
 # 文件管理路由
 @app.route('/api/files', methods=['GET'])
+@etag_conditional(files_etag)
 def get_files():
-    files = load_files()
+    """文件列表
+
+    不带参数时返回完整数组（兼容旧接口）；带 limit/cursor/folder/type/sort/order
+    任一参数时分页返回 {'items', 'next_cursor', 'total'}；total 只在第一页返回，之后为 null。
+    """
+    paginated = any(key in request.args for key in ('limit', 'cursor', 'folder', 'type', 'sort', 'order'))
+    if paginated:
+        sort = request.args.get('sort', 'upload_date')
+        if sort not in FILE_SORT_FIELDS:
+            return jsonify({'success': False, 'message': '不支持的排序字段'}), 400
+        cursor = None
+        if request.args.get('cursor'):
+            cursor = decode_cursor(request.args['cursor'])
+            expected = str if sort == 'upload_date' else (int, float)
+            if cursor is None or not isinstance(cursor[0], expected) or isinstance(cursor[0], bool):
+                return jsonify({'success': False, 'message': '无效的分页游标'}), 400
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        files, next_cursor, total = files_catalog.page(
+            folder=request.args.get('folder') or None,
+            file_type=request.args.get('type') or None,
+            sort=sort,
+            descending=request.args.get('order', 'desc') != 'asc',
+            cursor=cursor,
+            limit=limit)
+    else:
+        files = files_catalog.all()
+
+    # 合并还在内存里的下载计数
+    pending = download_counter.pending()
+    if pending:
+        for file_info in files:
+            file_info['downloads'] = file_info.get('downloads', 0) + pending.get(file_info['id'], 0)
+
+    if paginated:
+        return jsonify({'items': files, 'next_cursor': next_cursor, 'total': total})
     return jsonify(files)
 
+def build_file_info(original_name, digest, size, folder, description):
+    ext = original_name.rsplit('.', 1)[1].lower()
+    # 存储文件按内容命名、平铺在 FILES_FOLDER 下，文件夹只是目录里的分类
+    filename = f"{digest}.{ext}"
+    return {
+        'id': str(uuid.uuid4()),
+        'original_name': original_name,
+        'filename': filename,
+        'relative_path': filename,
+        'folder': folder if folder else None,
+        'description': description,
+        'size': size,
+        'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'type': ext,
+        'downloads': 0
+    }
+
+def save_file_resource(file, folder, description):
+    """把上传的文件写入临时文件，返回 (文件信息, 临时路径)；由 commit_file_resources 落盘入库"""
+    tmp_path, digest, size = stage_upload(file, app.config['FILES_FOLDER'])
+    return build_file_info(file.filename, digest, size, folder, description), tmp_path
+
+def commit_file_resources(staged):
+    """把暂存的文件放到内容地址上，并一次性写入文件目录
+
+    staged 是 [(文件信息, 临时路径)]；写目录失败时删掉这次新建的存储文件。
+    """
+    created = []
+    with blob_lock:
+        try:
+            for file_info, tmp_path in staged:
+                filepath = os.path.join(app.config['FILES_FOLDER'], file_info['relative_path'])
+                if place_blob(tmp_path, filepath):
+                    created.append(filepath)
+            files_catalog.add_many([file_info for file_info, _ in staged])
+            static_exporter.schedule()
+        except Exception:
+            for filepath in created:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            for _, tmp_path in staged:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+def file_resource_path(file_info):
+    return os.path.join(app.config['FILES_FOLDER'], file_info.get('relative_path') or file_info['filename'])
+
 @app.route('/api/files', methods=['POST'])
 @login_required
 def upload_file_resource():
@@ -365,50 +2487,34 @@ def upload_file_resource():
     uploaded_files = []
     errors = []
 
-    for file in files:
-        if file.filename == '':
-            continue
-
-        if allowed_file_upload(file.filename):
+    # 先把所有文件并发写入磁盘，文件信息暂存起来，最后一次性写入文件目录
+    staged = []
+    with ThreadPoolExecutor(max_workers=UPLOAD_SAVE_WORKERS) as pool:
+        for file in files:
+            if file.filename == '':
+                continue
+
+            if allowed_file_upload(file.filename):
+                staged.append((file, pool.submit(save_file_resource, file, folder, description)))
+            else:
+                staged.append((file, f"{file.filename}: 不支持的文件格式"))
+
+        for file, result in staged:
+            if isinstance(result, str):
+                errors.append(result)
+                continue
             try:
-                # 生成唯一文件名
-                ext = file.filename.rsplit('.', 1)[1].lower()
-                unique_filename = f"{uuid.uuid4().hex}.{ext}"
-
-                # 如果有文件夹，创建文件夹路径
-                if folder:
-                    folder_path = os.path.join(app.config['FILES_FOLDER'], folder)
-                    os.makedirs(folder_path, exist_ok=True)
-                    filepath = os.path.join(folder_path, unique_filename)
-                    relative_path = f"{folder}/{unique_filename}"
-                else:
-                    filepath = os.path.join(app.config['FILES_FOLDER'], unique_filename)
-                    relative_path = unique_filename
-
-                file.save(filepath)
-
-                # 保存文件信息
-                files_db = load_files()
-                file_info = {
-                    'id': str(uuid.uuid4()),
-                    'original_name': file.filename,
-                    'filename': unique_filename,
-                    'relative_path': relative_path,
-                    'folder': folder if folder else None,
-                    'description': description,
-                    'size': os.path.getsize(filepath),
-                    'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'type': ext,
-                    'downloads': 0
-                }
-                files_db.append(file_info)
-                save_files(files_db)
-
-                uploaded_files.append(file_info)
+                uploaded_files.append(result.result())
             except Exception as e:
                 errors.append(f"{file.filename}: {str(e)}")
-        else:
-            errors.append(f"{file.filename}: 不支持的文件格式")
+
+    if uploaded_files:
+        try:
+            commit_file_resources(uploaded_files)
+        except Exception as e:
+            errors.extend(f"{file_info['original_name']}: {str(e)}" for file_info, _ in uploaded_files)
+            uploaded_files = []
+        uploaded_files = [file_info for file_info, _ in uploaded_files]
 
     if uploaded_files:
         message = f'成功上传 {len(uploaded_files)} 个文件'
@@ -427,53 +2533,736 @@ def upload_file_resource():
         'errors': errors
     }), 400
 
+# 分块上传：init -> 按 offset PUT 数据块 -> complete
+# 数据块直接追加到 FILES_FOLDER/.uploads 下的 .part 文件，完成时计算哈希后改名到内容地址，
+# 断线后用 GET 查询已收到的 offset 继续上传即可。
+UPLOAD_SESSIONS_FOLDER = os.path.join(FILES_FOLDER, '.uploads')
+_upload_hashers = {}  # upload_id -> (已计算到的 offset, sha256)，数据块按顺序到达本进程时增量计算
+
+def load_upload_session(upload_id):
+    """返回 (上传信息, .part 路径, 锁)，上传不存在时返回 None"""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        return None
+    base = os.path.join(UPLOAD_SESSIONS_FOLDER, upload_id)
+    try:
+        with open(base + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f), base + '.part', FileLock(base + '.lock')
+    except FileNotFoundError:
+        return None
+
+def remove_upload_session(upload_id):
+    _upload_hashers.pop(upload_id, None)
+    base = os.path.join(UPLOAD_SESSIONS_FOLDER, upload_id)
+    for suffix in ('.json', '.part', '.lock'):
+        if os.path.exists(base + suffix):
+            os.remove(base + suffix)
+
+def cleanup_upload_sessions():
+    """删除超过 UPLOAD_SESSION_TTL 没有动静的未完成上传"""
+    cutoff = time.time() - UPLOAD_SESSION_TTL
+    for entry in os.scandir(UPLOAD_SESSIONS_FOLDER):
+        if entry.name.endswith('.json'):
+            upload_id = entry.name[:-len('.json')]
+            part_path = os.path.join(UPLOAD_SESSIONS_FOLDER, upload_id + '.part')
+            last_active = os.path.getmtime(part_path) if os.path.exists(part_path) else entry.stat().st_mtime
+            if last_active < cutoff:
+                remove_upload_session(upload_id)
+
+@app.route('/api/files/uploads', methods=['POST'])
+@login_required
+def init_chunked_upload():
+    """开始一个分块上传"""
+    params = request.json or {}
+    filename = params.get('filename', '')
+    size = params.get('size')
+
+    if not filename or not allowed_file_upload(filename):
+        return jsonify({'success': False, 'message': '不支持的文件格式'}), 400
+    if not isinstance(size, int) or size < 0 or size > MAX_CHUNKED_UPLOAD_SIZE:
+        return jsonify({'success': False, 'message': '文件大小无效'}), 400
+
+    os.makedirs(UPLOAD_SESSIONS_FOLDER, exist_ok=True)
+    cleanup_upload_sessions()
+
+    upload_id = uuid.uuid4().hex
+    session_info = {
+        'filename': filename,
+        'size': size,
+        'folder': (params.get('folder') or '').strip(),
+        'description': params.get('description', ''),
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    base = os.path.join(UPLOAD_SESSIONS_FOLDER, upload_id)
+    open(base + '.part', 'wb').close()
+    atomic_write(base + '.json', json.dumps(session_info, ensure_ascii=False).encode('utf-8'))
+
+    return jsonify({'success': True, 'upload_id': upload_id, 'offset': 0, 'chunk_size': UPLOAD_CHUNK_SIZE})
+
+@app.route('/api/files/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_chunked_upload(upload_id):
+    """查询已收到的字节数，断线重连后从这里继续"""
+    upload = load_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': '上传不存在或已过期'}), 404
+    session_info, part_path, _ = upload
+    return jsonify({'success': True, 'offset': os.path.getsize(part_path), 'size': session_info['size']})
+
+@app.route('/api/files/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id):
+    """写入一个数据块，请求体就是原始数据，?offset= 是它在文件中的位置"""
+    upload = load_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': '上传不存在或已过期'}), 404
+    session_info, part_path, lock = upload
+    offset = request.args.get('offset', type=int)
+
+    with lock:
+        received = os.path.getsize(part_path)
+        # 允许重传已收到的部分（offset 小于已收到的字节数，原样覆盖写入），但不能留空洞
+        if offset is None or offset < 0 or offset > received:
+            return jsonify({'success': False, 'message': '数据块位置不正确', 'offset': received}), 409
+        remaining = session_info['size'] - offset
+        if (request.content_length or 0) > remaining:
+            return jsonify({'success': False, 'message': '超出文件大小', 'offset': received}), 400
+
+        hashed = _upload_hashers.get(upload_id)
+        if hashed is None and offset == 0:
+            hashed = (0, hashlib.sha256())
+        hasher = hashed[1] if hashed and hashed[0] == offset else None
+
+        with open(part_path, 'r+b') as f:
+            # 不截断：延迟到达的重复数据块不能把后面已经收到的数据丢掉
+            f.seek(offset)
+            # 边接收边写入，不在内存或临时文件里缓冲整个数据块
+            try:
+                while remaining > 0:
+                    chunk = request.stream.read(min(64 * 1024, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+            finally:
+                end = f.tell()
+                if hasher is not None:
+                    _upload_hashers[upload_id] = (end, hasher)
+                elif end > received:
+                    _upload_hashers.pop(upload_id, None)
+                received = max(received, end)
+
+    return jsonify({'success': True, 'offset': received})
+
+@app.route('/api/files/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_chunked_upload(upload_id):
+    """所有数据块上传完成后，把文件放到内容地址并写入文件目录"""
+    upload = load_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': '上传不存在或已过期'}), 404
+    session_info, part_path, lock = upload
+
+    with lock:
+        size = os.path.getsize(part_path)
+        if size != session_info['size']:
+            return jsonify({'success': False, 'message': '文件还没有上传完整', 'offset': size}), 409
+
+        hashed = _upload_hashers.pop(upload_id, None)
+        if hashed and hashed[0] == size:
+            hasher = hashed[1]
+        else:
+            # 数据块不是按顺序到达本进程的，重新读一遍计算哈希
+            hasher = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+
+        file_info = build_file_info(session_info['filename'], hasher.hexdigest()[:32], size,
+                                    session_info['folder'], session_info['description'])
+        try:
+            commit_file_resources([(file_info, part_path)])
+        except Exception as e:
+            return jsonify({'success': False, 'message': f'保存失败: {str(e)}'}), 500
+        finally:
+            remove_upload_session(upload_id)
+
+    return jsonify({'success': True, 'message': '上传成功', 'file': file_info})
+
+@app.route('/api/files/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_chunked_upload(upload_id):
+    """放弃一个未完成的上传"""
+    upload = load_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'success': False, 'message': '上传不存在或已过期'}), 404
+    with upload[2]:
+        remove_upload_session(upload_id)
+    return jsonify({'success': True, 'message': '已取消上传'})
+
 @app.route('/api/files/<file_id>', methods=['DELETE'])
 @login_required
 def delete_file(file_id):
     try:
-        files = load_files()
-        file_to_delete = None
-        
-        for file_info in files:
-            if file_info['id'] == file_id:
-                file_to_delete = file_info
-                break
+        file_to_delete = files_catalog.get(file_id)
         
         if not file_to_delete:
             return jsonify({'success': False, 'message': '文件未找到'}), 404
         
-        # 删除物理文件
-        filepath = os.path.join(app.config['FILES_FOLDER'], file_to_delete['filename'])
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        # 从数据库中删除
-        files = [f for f in files if f['id'] != file_id]
-        save_files(files)
+        with blob_lock:
+            # 从数据库中删除
+            files_catalog.delete(file_id)
+            static_exporter.schedule()
+
+            # 存储文件按内容共享，没有其他记录引用时才删除物理文件
+            filepath = file_resource_path(file_to_delete)
+            if (not files_catalog.count_references(file_to_delete.get('relative_path') or file_to_delete['filename'])
+                    and os.path.exists(filepath)):
+                os.remove(filepath)
         
         return jsonify({'success': True, 'message': '文件已删除'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'删除失败: {str(e)}'}), 500
 
+def parse_byte_ranges(size):
+    """把 Range 请求头解析成 [(start, end)]（end 不含）；没有 Range 时返回 None，无法满足时返回 []"""
+    if request.range is None or request.range.units != 'bytes':
+        return None
+    ranges = []
+    for start, stop in request.range.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+def iter_file_range(f, start, end, chunk_size=256 * 1024):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+class ClosingBody:
+    """带关闭函数的响应体
+
+    direct_passthrough 的响应体由服务器直接迭代，response.call_on_close 注册的
+    函数不会被调用；服务器发送完（或客户端断开）时调用的是响应体的 close()。
+    生成器还没开始迭代时 close() 也不会执行它的 finally，所以在这里关闭文件。
+    """
+
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._on_close()
+
+def send_file_ranges(path, mimetype):
+    """发送文件，支持单个和多个 Range（206）
+
+    gunicorn 下从文件开头发送的响应（完整下载、bytes=0-...）把文件对象交给
+    wsgi.file_wrapper，由它按 Content-Length 用 sendfile 零拷贝发送，worker 线程
+    不用自己搬运数据。gunicorn 20.1 的 sendfile 总是从文件开头发送，所以从中间
+    开始的 Range 改为分块读取发送；要全部零拷贝请使用 FILE_OFFLOAD。
+    """
+    st = os.stat(path)
+    size = st.st_size
+    etag = f'{st.st_mtime_ns:x}-{size:x}'
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    ranges = parse_byte_ranges(size)
+    # If-Range 和当前版本不一致时忽略 Range，返回完整文件
+    if ranges is not None and request.if_range.etag and request.if_range.etag != etag:
+        ranges = None
+    if ranges == []:
+        response = app.response_class(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+
+    f = open(path, 'rb')
+    if ranges is None or len(ranges) == 1:
+        start, end = ranges[0] if ranges else (0, size)
+        if start == 0 and request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            body = wrap_file(request.environ, f)
+        else:
+            body = ClosingBody(iter_file_range(f, start, end), f.close)
+        response = app.response_class(body, status=206 if ranges else 200,
+                                      mimetype=mimetype, direct_passthrough=True)
+        response.content_length = end - start
+        if ranges:
+            response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    else:
+        boundary = uuid.uuid4().hex
+
+        def generate():
+            for start, end in ranges:
+                yield (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                       f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode('ascii')
+                yield from iter_file_range(f, start, end)
+                yield b'\r\n'
+            yield f'--{boundary}--\r\n'.encode('ascii')
+
+        response = app.response_class(ClosingBody(generate(), f.close), status=206, direct_passthrough=True,
+                                      content_type=f'multipart/byteranges; boundary={boundary}')
+    response.set_etag(etag)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def attachment_disposition(download_name):
+    try:
+        download_name.encode('ascii')
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(download_name)}"
+
 @app.route('/files/<path:filename>')
 def download_file(filename):
-    # 支持文件夹路径（例如：documents/file.pdf）
-    return send_from_directory(app.config['FILES_FOLDER'], filename, as_attachment=True)
+    # 支持文件夹路径（例如：documents/file.pdf）；.uploads 等隐藏目录里是未完成的上传，不对外提供
+    if is_hidden_path(filename):
+        abort(404)
+    path = safe_join(os.path.abspath(app.config['FILES_FOLDER']), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if FILE_OFFLOAD == 'x-accel':
+        response = app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX + quote(filename)
+    elif FILE_OFFLOAD == 'x-sendfile':
+        response = app.response_class(mimetype=mimetype)
+        response.headers['X-Sendfile'] = path
+    else:
+        response = send_file_ranges(path, mimetype)
+
+    response.headers['Content-Disposition'] = attachment_disposition(os.path.basename(filename))
+    return response
 
 @app.route('/api/files/<file_id>/download', methods=['POST'])
 def increment_download(file_id):
-    files = load_files()
-    for file_info in files:
-        if file_info['id'] == file_id:
-            file_info['downloads'] += 1
-            save_files(files)
-            return jsonify({'success': True})
+    if files_catalog.exists(file_id):
+        download_counter.add(file_id)
+        return jsonify({'success': True})
     return jsonify({'success': False, 'message': '文件未找到'}), 404
 
+# ZIP 打包：边读文件边压缩边发送，不写临时文件，也不把整个压缩包放在内存里
+ZIP_CHUNK_SIZE = 256 * 1024
+
+class _ZipStream:
+    """zipfile 的写入目标（不可 seek），写入的数据由 stream_zip 取走发送"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries):
+    """entries 是 (压缩包里的路径, 磁盘路径或 bytes) 列表，逐块生成 ZIP 数据；
+    图片、压缩包等已经压缩过的文件直接存储"""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for arcname, source in entries:
+            compressed = os.path.splitext(arcname)[1].lower() in COMPRESSIBLE_EXTENSIONS
+            compress_type = zipfile.ZIP_DEFLATED if compressed else zipfile.ZIP_STORED
+            if isinstance(source, bytes):
+                info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                info.compress_type = compress_type
+                archive.writestr(info, source)
+                yield stream.take()
+                continue
+            try:
+                f = open(source, 'rb')
+            except FileNotFoundError:
+                print(f'打包时文件不存在: {source}')
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                # ZIP 只能记录 1980 年以后的时间
+                info = zipfile.ZipInfo(arcname, time.localtime(max(st.st_mtime, 315619200))[:6])
+                info.compress_type = compress_type
+                with archive.open(info, 'w', force_zip64=st.st_size > zipfile.ZIP64_LIMIT) as dest:
+                    while True:
+                        chunk = f.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield stream.take()
+            yield stream.take()
+    # 关闭时写入中央目录
+    yield stream.take()
+
+def zip_response(entries, download_name):
+    response = app.response_class(stream_zip(entries), mimetype='application/zip')
+    response.headers['Content-Disposition'] = attachment_disposition(download_name)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def unique_arcname(name, used):
+    """同一个文件夹里有重名文件时改成 name (2).ext"""
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f'{stem} ({n}){ext}'
+    used.add(candidate)
+    return candidate
+
+@app.route('/api/files/export', methods=['GET'])
+@login_required
+def export_folder():
+    """把一个文件夹（?folder=）里的文件打包成 ZIP 下载，文件使用上传时的文件名
+
+    打包要占用一个请求线程直到发送完，只对管理员开放，访客逐个下载文件。
+    """
+    folder = request.args.get('folder', '').strip()
+    if not folder:
+        return jsonify({'success': False, 'message': '缺少文件夹名称'}), 400
+    files = [f for f in files_catalog.all() if f.get('folder') == folder]
+    if not files:
+        return jsonify({'success': False, 'message': '文件夹不存在或为空'}), 404
+    used = set()
+    entries = [(unique_arcname(os.path.basename(f['original_name']) or f['filename'], used), file_resource_path(f))
+               for f in files]
+    return zip_response(entries, f'{folder}.zip')
+
+def backup_entries():
+    """完整备份的内容：data.json（不含密码）、files.json、files/ 下的文件资源和 uploads/ 下的图片"""
+    files = files_catalog.all()
+    entries = [
+        ('data.json', json.dumps(public_data(), ensure_ascii=False, indent=2).encode('utf-8')),
+        ('files.json', json.dumps(files, ensure_ascii=False, indent=2).encode('utf-8')),
+    ]
+    # 相同内容的文件共用一个存储文件，只打包一次
+    for relative_path in sorted({f.get('relative_path') or f['filename'] for f in files}):
+        entries.append((f'files/{relative_path}', os.path.join(app.config['FILES_FOLDER'], relative_path)))
+    uploads = app.config['UPLOAD_FOLDER']
+    for name in sorted(os.listdir(uploads)) if os.path.isdir(uploads) else []:
+        if not name.startswith('.') and os.path.isfile(os.path.join(uploads, name)):
+            entries.append((f'uploads/{name}', os.path.join(uploads, name)))
+    return entries
+
+@app.route('/api/backup', methods=['GET'])
+@login_required
+def export_backup():
+    return zip_response(backup_entries(), f"backup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip")
+
+def backup_member_target(filename):
+    """备份里的文件应该恢复到的路径；files/ 和 uploads/ 以外的文件返回 None，不安全的路径抛出 ValueError"""
+    for prefix, directory in (('files/', app.config['FILES_FOLDER']), ('uploads/', app.config['UPLOAD_FOLDER'])):
+        if filename.startswith(prefix):
+            name = filename[len(prefix):]
+            dest = safe_join(os.path.abspath(directory), name)
+            if dest is None or any(part.startswith('.') for part in name.split('/')):
+                raise ValueError(f'不安全的路径: {filename}')
+            return dest
+    return None
+
+def valid_backup_file_info(file_info):
+    """备份里的一条文件记录能否写进目录：必填字段是非空字符串，其余字段是对应类型或为空"""
+    if not isinstance(file_info, dict):
+        return False
+    if not all(isinstance(file_info.get(key), str) and file_info[key] for key in ('id', 'original_name', 'filename')):
+        return False
+    for key in ('relative_path', 'folder', 'description', 'upload_date', 'type'):
+        if not isinstance(file_info.get(key), (str, type(None))):
+            return False
+    return all(isinstance(file_info.get(key), (int, type(None))) and not isinstance(file_info.get(key), bool)
+               for key in ('size', 'downloads'))
+
+def restore_member(archive, member, dest):
+    """把压缩包里的一个文件分块解压到目标目录下的临时文件，返回临时路径"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(dest), f'.{uuid.uuid4().hex}.part')
+    try:
+        with archive.open(member) as src, open(tmp_path, 'wb') as out:
+            shutil.copyfileobj(src, out, ZIP_CHUNK_SIZE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path
+
+@app.route('/api/backup', methods=['POST'])
+@login_required
+def import_backup():
+    """从 GET /api/backup 导出的 ZIP 恢复：表单字段 backup 或直接以 application/zip 作为请求体
+
+    ZIP 的目录在文件末尾，请求体先分块写入临时文件再逐个解压；保留当前的管理员密码。
+    """
+    if request.content_length is not None and request.content_length > MAX_BACKUP_UPLOAD_SIZE:
+        return jsonify({'success': False, 'message': '备份文件太大'}), 413
+    upload = request.files.get('backup')
+    with ExitStack() as stack:
+        if upload is not None:
+            source = upload.stream
+        else:
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            source = stack.enter_context(tempfile.TemporaryFile(dir=CACHE_FOLDER))
+            shutil.copyfileobj(request.stream, source, ZIP_CHUNK_SIZE)
+            source.seek(0)
+        try:
+            archive = stack.enter_context(zipfile.ZipFile(source))
+            new_data = json.loads(archive.read('data.json'))
+            files = json.loads(archive.read('files.json')) if 'files.json' in archive.namelist() else None
+        except KeyError:
+            return jsonify({'success': False, 'message': '备份中缺少 data.json'}), 400
+        except (zipfile.BadZipFile, ValueError) as e:
+            return jsonify({'success': False, 'message': f'备份文件无效: {str(e)}'}), 400
+        if not isinstance(new_data, dict) or 'profile' not in new_data or not (files is None or isinstance(files, list)
+                                                  and all(map(valid_backup_file_info, files))):
+            return jsonify({'success': False, 'message': '备份文件格式不正确'}), 400
+
+        # 先检查所有路径，有问题时什么都不写
+        try:
+            targets = [(member, backup_member_target(member.filename))
+                       for member in archive.infolist() if not member.is_dir()]
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        restored_files = restored_uploads = 0
+        try:
+            for member, dest in targets:
+                if dest is None:
+                    continue
+                tmp_path = restore_member(archive, member, dest)
+                if member.filename.startswith('files/'):
+                    with blob_lock:
+                        place_blob(tmp_path, dest)
+                    restored_files += 1
+                else:
+                    os.replace(tmp_path, dest)
+                    restored_uploads += 1
+        except (zipfile.BadZipFile, OSError) as e:
+            print(f'恢复备份错误: {str(e)}')
+            return jsonify({'success': False, 'message': f'恢复文件失败: {str(e)}'}), 400
+
+    if files is not None:
+        with blob_lock:
+            files_catalog.replace_all(files)
+        static_exporter.schedule()
+        file_scanner.request_scan()
+    new_data['admin_password'] = load_data()['admin_password']
+    save_data(new_data)
+    return jsonify({
+        'success': True,
+        'message': f'已恢复数据、{restored_files} 个文件和 {restored_uploads} 张图片',
+        'files': restored_files,
+        'uploads': restored_uploads
+    })
+
+# 站内搜索：文件、项目和自定义模块的倒排索引
+SEARCH_MAX_RESULTS = 50
+SEARCH_PREFIX_EXPANSIONS = 50  # 一个前缀最多展开成多少个词
+_SEARCH_TOKEN_RE = re.compile(
+    r'[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+')
+
+def search_tokens(text, query=False):
+    """分词：字母数字按单词切分；中日韩文字没有空格，切成单字和相邻两字
+
+    建索引时单字和双字都收录；查询时两个字以上只用双字（相当于短语匹配），单个字用单字。
+    """
+    tokens = []
+    for run in _SEARCH_TOKEN_RE.findall(unicodedata.normalize('NFKC', str(text)).lower()):
+        if run.isascii():
+            tokens.append(run)
+            continue
+        bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+        if query:
+            tokens.extend(bigrams or [run])
+        else:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+    return tokens
+
+
+class SearchIndex:
+    """内存里的倒排索引：词 -> {文档: 加权词频}
+
+    查询前和当前数据文档、文件目录对比，只重新分词内容变化了的项目、模块和文件，
+    其他 worker 保存的修改也会在下一次查询时同步进来。
+    """
+
+    # 字段权重：标题命中比正文命中排得靠前
+    FIELDS = {
+        'file': (('original_name', 3), ('folder', 2), ('description', 1)),
+        'project': (('title', 3), ('tags', 2), ('description', 1)),
+        'module': (('title', 3), ('content', 1)),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}  # 词 -> {(类型, id): 加权词频}
+        self._terms = []  # 排好序的所有词，用来做前缀匹配
+        self._docs = {}  # (类型, id) -> (字段内容, 原始记录)
+        self._doc_terms = {}  # (类型, id) -> {词: 加权词频}，删除和更新时使用
+        self._data_doc = None
+        self._files_version = None
+
+    @classmethod
+    def _fields(cls, kind, record):
+        values = []
+        for field, _ in cls.FIELDS[kind]:
+            value = record.get(field) or ''
+            if isinstance(value, (list, tuple)):
+                value = ' '.join(str(v) for v in value)
+            values.append(str(value))
+        return tuple(values)
+
+    def _remove(self, key):
+        for term in self._doc_terms.pop(key, {}):
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        self._docs.pop(key, None)
+
+    def _add(self, key, fields, record):
+        weights = Counter()
+        for (_, weight), value in zip(self.FIELDS[key[0]], fields):
+            for term in search_tokens(value):
+                weights[term] += weight
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[key] = weight
+        self._doc_terms[key] = weights
+        self._docs[key] = (fields, record)
+
+    def _sync_kind(self, kind, records):
+        """把某一类文档同步成 records，返回重新分词的数量"""
+        changed = 0
+        seen = set()
+        for record in records:
+            key = (kind, str(record.get('id')))
+            seen.add(key)
+            fields = self._fields(kind, record)
+            current = self._docs.get(key)
+            if current is not None and current[0] == fields:
+                self._docs[key] = (fields, record)
+                continue
+            self._remove(key)
+            self._add(key, fields, record)
+            changed += 1
+        for key in [k for k in self._docs if k[0] == kind and k not in seen]:
+            self._remove(key)
+            changed += 1
+        return changed
+
+    def sync(self):
+        """和当前数据对比，增量更新索引（持有 self._lock）"""
+        doc = read_data()
+        if doc is not self._data_doc:
+            self._sync_kind('project', [p for p in doc.get('projects', []) if isinstance(p, dict)])
+            # 内置模块没有内容，隐藏的模块不应被搜到
+            self._sync_kind('module', [m for m in (doc.get('modules') or {}).values()
+                                       if isinstance(m, dict) and m.get('type') != 'built-in'
+                                       and m.get('visible', True)])
+            self._data_doc = doc
+        # 下载次数不参与搜索，只累加下载次数时不用重新读取目录
+        version = files_catalog.content_version()
+        if version != self._files_version:
+            self._sync_kind('file', files_catalog.all())
+            self._files_version = version
+
+    def _expand(self, token):
+        """查询词对应的索引词和权重：完全匹配为 1；字母数字的词还匹配以它开头的词（前缀匹配）"""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+        if token.isascii():
+            start = bisect.bisect_right(self._terms, token)
+            for term in self._terms[start:start + SEARCH_PREFIX_EXPANSIONS]:
+                if not term.startswith(token):
+                    break
+                matches[term] = 0.5
+        return matches
+
+    def search(self, query, kind=None, limit=20):
+        """返回 (按相关度排序的 [(得分, 类型, 记录)], 命中总数)；所有查询词都要命中"""
+        tokens = list(dict.fromkeys(search_tokens(query, query=True)))
+        if not tokens:
+            return [], 0
+        with self._lock:
+            self.sync()
+            total_docs = len(self._docs) or 1
+            scores = None
+            for token in tokens:
+                token_scores = {}
+                for term, factor in self._expand(token).items():
+                    postings = self._postings[term]
+                    idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for key, weight in postings.items():
+                        if kind is not None and key[0] != kind:
+                            continue
+                        # 词频饱和：同一个词出现很多次不会无限加分
+                        score = idf * factor * weight / (weight + 1.2)
+                        if score > token_scores.get(key, 0):
+                            token_scores[key] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {key: scores[key] + score for key, score in token_scores.items() if key in scores}
+                if not scores:
+                    return [], 0
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            return [(round(score, 4), key[0], self._docs[key][1]) for key, score in ranked[:limit]], len(ranked)
+
+
+search_index = SearchIndex()
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """站内搜索：?q=关键词&type=file|project|module&limit=20，按相关度返回文件、项目和自定义模块"""
+    query = request.args.get('q', '').strip()[:100]
+    kind = request.args.get('type') or None
+    if not query:
+        return jsonify({'success': False, 'message': '缺少搜索关键词'}), 400
+    if kind is not None and kind not in SearchIndex.FIELDS:
+        return jsonify({'success': False, 'message': '无效的类型'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), SEARCH_MAX_RESULTS)
+    results, total = search_index.search(query, kind, limit)
+    return jsonify({
+        'query': query,
+        'total': total,
+        'results': [{'type': result_type, 'score': score, 'item': record} for score, result_type, record in results]
+    })
+
 # 主题设置路由
 @app.route('/api/theme', methods=['GET'])
+@etag_conditional(data_etag)
 def get_theme():
-    data = load_data()
+    data = read_data()
     return jsonify(data.get('theme', {}))
 
 @app.route('/api/theme', methods=['POST'])
@@ -518,11 +3307,8 @@ def upload_cursor():
     if ext not in allowed_cursor_types:
         return jsonify({'success': False, 'message': '只支持 .cur, .png, .svg, .ico 格式的光标文件'}), 400
     
-    # 生成唯一文件名
-    filename = f"cursor_{uuid.uuid4().hex}.{ext}"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    
-    file.save(filepath)
+    # 按内容命名
+    filename = save_upload(file, ext)
     cursor_url = f"/static/uploads/{filename}"
     
     # 更新数据配置
@@ -565,6 +3351,7 @@ def upload_avatar():
         
         # 保存文件
         file.save(filepath)
+        schedule_image_derivatives(filepath)
         avatar_url = f"/static/uploads/{filename}"
         
         # 更新数据配置
@@ -601,12 +3388,9 @@ def upload_background():
         return jsonify({'success': False, 'message': '只支持图片格式（PNG, JPG, GIF, WebP）'}), 400
 
     try:
-        # 生成唯一文件名
-        filename = f"background_{uuid.uuid4().hex[:8]}.{ext}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-        # 保存文件
-        file.save(filepath)
+        # 按内容命名保存文件
+        filename = save_upload(file, ext)
+        schedule_image_derivatives(os.path.join(app.config['UPLOAD_FOLDER'], filename))
         background_url = f"/static/uploads/{filename}"
 
         return jsonify({
@@ -619,8 +3403,9 @@ def upload_background():
 
 # 布局设置路由
 @app.route('/api/layout', methods=['GET'])
+@etag_conditional(data_etag)
 def get_layout():
-    data = load_data()
+    data = read_data()
     return jsonify(data.get('layout', {}))
 
 @app.route('/api/layout', methods=['POST'])
@@ -648,9 +3433,10 @@ def update_layout():
 
 # 后台界面主题设置路由
 @app.route('/api/admin-theme', methods=['GET'])
+@etag_conditional(data_etag)
 def get_admin_theme():
     """获取后台界面主题配置"""
-    data = load_data()
+    data = read_data()
     admin_theme = data.get('admin_theme', {
         'primary_color': '#6366f1',
         'sidebar_bg': '#1f2937',
@@ -689,9 +3475,10 @@ def update_admin_theme():
 
 # 模块管理路由
 @app.route('/api/modules', methods=['GET'])
+@etag_conditional(data_etag)
 def get_modules():
     """获取所有模块配置"""
-    data = load_data()
+    data = read_data()
     modules = data.get('modules', {})
     return jsonify(modules)
 
@@ -791,36 +3578,443 @@ def update_module_order():
 
 # 静态文件路由 - 提供data.json访问
 @app.route('/data.json')
+@etag_conditional(data_etag)
 def serve_data_json():
-    data = load_data()
     # 不返回密码
-    if 'admin_password' in data:
-        del data['admin_password']
-    return jsonify(data)
+    return jsonify(public_data())
+
+class ChangeNotifier:
+    """内容变化通知
+
+    后台线程每 SSE_POLL_INTERVAL 秒检查一次数据文档和文件目录的版本：
+    其他 worker 的保存会追加到 data.journal 或写进 files.db，所以各个 worker
+    读同一份文件就能知道变化，不需要额外的消息服务。发现变化后生成事件
+    （变化的顶层字段和对应的 JSON Patch），唤醒本进程所有的 SSE 连接。
+    """
+
+    def __init__(self, poll_interval=SSE_POLL_INTERVAL, max_streams=SSE_MAX_STREAMS, history=64):
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)  # (序号, 事件)
+        self._seq = 0
+        self._streams = 0
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def current_id(self):
+        return f'{data_etag()}.{files_catalog.version()}'
+
+    def _run(self):
+        doc, files_version = data_store.read(), files_catalog.version()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                new_doc, new_files_version = data_store.read(), files_catalog.version()
+                event = self._diff(doc, new_doc, files_version != new_files_version)
+                doc, files_version = new_doc, new_files_version
+                if event:
+                    event['id'] = f'{data_store.etag}.{new_files_version}'
+                    self.publish(event)
+            except Exception as e:
+                print(f'检查内容变化错误: {str(e)}')
+
+    @staticmethod
+    def _diff(old, new, files_changed):
+        sections = []
+        patch = []
+        if old is not new:
+            for op in _diff_ops(old, new, [], []):
+                if op[1][0] == 'admin_password':
+                    continue
+                pointer = '/' + '/'.join(str(part).replace('~', '~0').replace('/', '~1') for part in op[1])
+                if op[0] == 'set':
+                    patch.append({'op': 'add', 'path': pointer, 'value': _thaw(op[2])})
+                else:
+                    patch.append({'op': 'remove', 'path': pointer})
+                if op[1][0] not in sections:
+                    sections.append(op[1][0])
+        if files_changed:
+            sections.append('files')
+        if not sections:
+            return None
+        return {'sections': sections, 'patch': patch}
+
+    def publish(self, event):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event))
+            self._cond.notify_all()
+
+    def open_stream(self):
+        """占用一个连接名额，满了返回 None；否则返回当前事件序号"""
+        with self._cond:
+            if self._streams >= self.max_streams:
+                return None
+            self._streams += 1
+            self._ensure_started()
+            return self._seq
+
+    def close_stream(self):
+        with self._cond:
+            self._streams -= 1
+
+    def wait(self, after, timeout):
+        """等待序号大于 after 的事件，返回 (事件列表, 最新序号, 是否漏掉了事件)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after, timeout)
+            events = [event for seq, event in self._events if seq > after]
+            missed = bool(self._events) and self._events[0][0] > after + 1 and self._seq > after
+            return events, self._seq, missed
+
+
+change_notifier = ChangeNotifier()
+
+def sse_message(event_type, data, event_id=None):
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/api/events')
+def content_events():
+    """用 Server-Sent Events 推送内容变化
+
+    每次保存后发送 change 事件：{sections: 变化的顶层字段（文件变化为 'files'）,
+    patch: 数据文档的 JSON Patch}。重连时 Last-Event-ID 和当前版本不一致，或者
+    错过了事件，发送 {reload: true}，页面应重新获取 /data.json。
+    """
+    if not SSE_ENABLED:
+        return jsonify({'success': False, 'message': '内容推送未开启'}), 404
+    seq = change_notifier.open_stream()
+    if seq is None:
+        response = jsonify({'success': False, 'message': '推送连接已满'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    last_event_id = request.headers.get('Last-Event-ID')
+
+    def stream():
+        current_id = change_notifier.current_id()
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        if last_event_id and last_event_id != current_id:
+            yield sse_message('change', {'sections': ['*'], 'reload': True}, current_id)
+        after = seq
+        deadline = time.time() + SSE_STREAM_DURATION
+        while time.time() < deadline:
+            events, after, missed = change_notifier.wait(after, SSE_HEARTBEAT)
+            if missed:
+                yield sse_message('change', {'sections': ['*'], 'reload': True}, change_notifier.current_id())
+                continue
+            if not events:
+                yield ': ping\n\n'
+            for event in events:
+                yield sse_message('change', {'sections': event['sections'], 'patch': event['patch']},
+                                  event['id'])
+
+    response = app.response_class(stream(), mimetype='text/event-stream')
+    # 连接断开（或生成器还没开始就被关闭）时都会调用，归还连接名额
+    response.call_on_close(change_notifier.close_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx 不要缓冲
+    return response
+
+# 静态站点导出：公开首页渲染成静态文件（内联数据和文件列表，资源用 build_assets 构建的版本），
+# 可以整个交给静态托管/CDN，Flask 只处理后台和 API
+def _link_or_copy(src, dest):
+    """硬链接到导出目录（不占额外空间），跨文件系统时复制"""
+    if os.path.exists(dest):
+        if os.path.samefile(src, dest):
+            return
+        os.remove(dest)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+def _export_assets(output, written):
+    """把当前构建的 css/js 链接到导出目录，页面里的 asset_url 已经指向这些文件"""
+    for built in (_asset_manifest or build_assets()).values():
+        dest = os.path.join(output, 'static', built)
+        _link_or_copy(os.path.join(app.static_folder, built), dest)
+        written.add(os.path.abspath(dest))
+
+def _remove_stale(directory, written):
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.abspath(os.path.join(root, filename))
+            if path not in written:
+                os.remove(path)
+
+def export_static_site(output):
+    """把公开首页导出到 output 目录，返回导出的文件数"""
+    with FileLock(output.rstrip('/\\') + '.lock'):
+        os.makedirs(output, exist_ok=True)
+        written = set()
+        _export_assets(output, written)
+
+        # 上传的图片和文件资源直接链接过去，下载地址和站点上一致
+        uploads = app.config['UPLOAD_FOLDER']
+        for name in os.listdir(uploads) if os.path.isdir(uploads) else []:
+            if not name.startswith('.') and os.path.isfile(os.path.join(uploads, name)):
+                dest = os.path.join(output, 'static', 'uploads', name)
+                _link_or_copy(os.path.join(uploads, name), dest)
+                written.add(os.path.abspath(dest))
+        # 和首页的文件列表一样按上传时间倒序
+        files = sorted(files_catalog.all(), key=lambda f: f.get('upload_date') or '', reverse=True)
+        for file_info in files:
+            source = file_resource_path(file_info)
+            if os.path.exists(source):
+                dest = os.path.join(output, 'files', file_info.get('relative_path') or file_info['filename'])
+                _link_or_copy(source, dest)
+                written.add(os.path.abspath(dest))
+
+        data = public_data()
+        with app.app_context():
+            html = render_template('index.html', data=data,
+                                   static_site={'files': files, 'exported_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        for name, raw in (('data.json', json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')),
+                          ('index.html', html.encode('utf-8'))):
+            atomic_write(os.path.join(output, name), raw)
+            written.add(os.path.abspath(os.path.join(output, name)))
+
+        # 页面已经指向新的资源文件，删掉旧版本和已删除的文件
+        _remove_stale(os.path.join(output, 'static'), written)
+        _remove_stale(os.path.join(output, 'files'), written)
+        return len(written)
+
+
+class StaticExporter(BackgroundWorker):
+    """内容或文件变化后在后台重新导出静态站点；每 interval 秒最多导出一次，
+    这期间的多次保存合并成一次导出"""
+
+    label = '导出静态站点'
+
+    def __init__(self, output, interval=2):
+        super().__init__(interval)
+        self.output = output
+        self._pending = False
+
+    def schedule(self):
+        if not self.output:
+            return
+        with self._lock:
+            self._pending = True
+            self._ensure_started()
+
+    def run_once(self):
+        with self._lock:
+            pending, self._pending = self._pending, False
+        if not pending:
+            return
+        try:
+            export_static_site(self.output)
+        except Exception:
+            with self._lock:
+                self._pending = True
+            raise
+
+
+static_exporter = StaticExporter(STATIC_EXPORT_FOLDER)
+data_store.subscribe(static_exporter.schedule)
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """输出带内容哈希的 css/js（加载 app 时已经构建好）"""
+    for name, built in _asset_manifest.items():
+        print(f'{name} -> {built}')
+
+@app.cli.command('export-static')
+@click.option('--output', default=STATIC_EXPORT_FOLDER or 'dist', show_default=True, help='导出目录')
+def export_static_command(output):
+    """把公开首页导出为静态站点"""
+    count = export_static_site(output)
+    print(f'静态站点已导出到 {output}（{count} 个文件）')
 
 # 启动时初始化
 init_data()
+try:
+    build_assets()
+except OSError as e:
+    print(f'构建静态资源错误: {str(e)}')
+precompress_static()
+
+def scan_files_folder(root):
+    """用 os.scandir 遍历一次存储目录，返回 {相对路径: 大小}；跳过临时文件和 .uploads 等隐藏目录"""
+    found = {}
+    stack = ['']
+    while stack:
+        prefix = stack.pop()
+        try:
+            entries = list(os.scandir(os.path.join(root, prefix)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            rel = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(rel + '/')
+            elif entry.is_file():
+                found[rel] = entry.stat().st_size
+    return found
+
+def file_content_hash(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()[:32]
+
+
+class FileIntegrityScanner(BackgroundWorker):
+    """文件完整性检查
+
+    后台线程每 FILE_SCAN_INTERVAL 秒（或收到 request_scan 时）遍历一次存储目录，
+    和文件目录对账，找出丢失的文件、大小不符的文件和没有被引用的文件；
+    verify=True 时还会重新计算按内容命名的文件的哈希。结果带时间戳写入
+    .cache/files_status.json，所有 worker 共用，接口直接返回上次的结果。
+    """
+
+    label = '检查文件'
+
+    def __init__(self, path, interval=FILE_SCAN_INTERVAL):
+        super().__init__(interval)
+        self.path = path
+        self._file_lock = FileLock('files.status.lock')
+        self._verify_requested = False
+        self._scanning = False
+        self._cached = (None, None)  # (mtime, 报告)
+
+    def request_scan(self, verify=False):
+        with self._lock:
+            self._verify_requested = self._verify_requested or verify
+            self._scanning = True
+            self._ensure_started()
+        self.wake()
+
+    def start(self):
+        with self._lock:
+            self._ensure_started()
+
+    def current_report(self):
+        """返回上次的检查结果；还没有检查过时当场做一次不校验哈希的快速检查"""
+        report = self.report()
+        if report is None:
+            with self._file_lock:
+                report = self.report() or self.scan()
+        return report
+
+    def report(self):
+        """返回上次的检查结果，还没有检查过时返回 None"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._cached[0] != mtime:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._cached = (mtime, json.load(f))
+        return self._cached[1]
+
+    @property
+    def scanning(self):
+        return self._scanning
+
+    def run_once(self):
+        with self._lock:
+            verify, self._verify_requested = self._verify_requested, False
+            self._scanning = True
+        try:
+            with self._file_lock:
+                self.scan(verify)
+        finally:
+            with self._lock:
+                self._scanning = self._verify_requested
+
+    def scan(self, verify=False):
+        started = time.time()
+        root = app.config['FILES_FOLDER']
+        on_disk = scan_files_folder(root)
+        referenced = set()
+        missing_files, size_mismatches, corrupted_files = [], [], []
+        files = files_catalog.all()
+        for file_info in files:
+            rel = os.path.relpath(file_resource_path(file_info), root).replace(os.sep, '/')
+            referenced.add(rel)
+            entry = {'id': file_info['id'], 'name': file_info['original_name'], 'filename': rel}
+            if rel not in on_disk:
+                missing_files.append(entry)
+            elif file_info.get('size') is not None and file_info['size'] != on_disk[rel]:
+                size_mismatches.append(dict(entry, expected=file_info['size'], actual=on_disk[rel]))
+        if verify:
+            # 只有按内容命名的文件才能校验，同一个存储文件只算一次
+            for rel in sorted(referenced & on_disk.keys()):
+                stem = os.path.splitext(os.path.basename(rel))[0]
+                if re.fullmatch(r'[0-9a-f]{32}', stem) and file_content_hash(os.path.join(root, rel)) != stem:
+                    corrupted_files.append(rel)
+        report = {
+            'scanned_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'duration': round(time.time() - started, 3),
+            'verified': verify,
+            'total': len(files),
+            'missing': len(missing_files),
+            'missing_files': missing_files,
+            'size_mismatches': size_mismatches,
+            'corrupted_files': corrupted_files,
+            'orphan_files': sorted(on_disk.keys() - referenced)
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write(self.path, json.dumps(report, ensure_ascii=False, indent=2).encode('utf-8'))
+        return report
+
+
+file_scanner = FileIntegrityScanner(os.path.join(CACHE_FOLDER, 'files_status.json'))
+
+def files_status_summary(report):
+    """不带文件名的检查结果摘要，未登录的访客只能看到这些"""
+    if report is None:
+        return {'scanned_at': None}
+    summary = {key: report[key] for key in ('scanned_at', 'verified', 'total', 'missing')}
+    for key in ('size_mismatches', 'corrupted_files', 'orphan_files'):
+        summary[key] = len(report[key])
+    return summary
 
 @app.route('/api/files/status', methods=['GET'])
 def check_files_status():
-    """检查文件状态，返回哪些文件丢失"""
-    files = load_files()
-    missing_files = []
-    
-    for file_info in files:
-        filepath = os.path.join(app.config['FILES_FOLDER'], file_info['filename'])
-        if not os.path.exists(filepath):
-            missing_files.append({
-                'id': file_info['id'],
-                'name': file_info['original_name'],
-                'filename': file_info['filename']
-            })
-    
-    return jsonify({
-        'total': len(files),
-        'missing': len(missing_files),
-        'missing_files': missing_files
-    })
+    """返回最近一次文件检查的结果（哪些文件丢失、损坏或多余）
+
+    ?rescan=1 在后台重新检查，?verify=1 同时校验文件哈希；还没有任何结果时
+    当场做一次不校验哈希的快速检查。重新检查和详细结果需要登录，
+    未登录时只返回已有结果的数量摘要。
+    """
+    if 'logged_in' not in session:
+        if request.args.get('rescan') or request.args.get('verify'):
+            return jsonify({'error': '未登录'}), 401
+        return jsonify(dict(files_status_summary(file_scanner.report()), scanning=file_scanner.scanning))
+    report = file_scanner.current_report()
+    if request.args.get('rescan') or request.args.get('verify'):
+        file_scanner.request_scan(verify=bool(request.args.get('verify')))
+    else:
+        file_scanner.start()
+    return jsonify(dict(report, scanning=file_scanner.scanning))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 抓取接口，需要管理员登录或 METRICS_TOKEN"""
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and secrets.compare_digest(authorization, f'Bearer {METRICS_TOKEN}')
+    if not token_ok and 'logged_in' not in session:
+        return jsonify({'error': '未登录'}), 401
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     # Railway使用环境变量PORT
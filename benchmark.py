@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+本地性能基准 - 在临时目录里运行应用，测试各个路由和存储路径的吞吐量和延迟
+
+用法:
+    python benchmark.py                              # Flask 测试客户端，100 和 10000 个文件
+    python benchmark.py --sizes 100,10000,100000 --gunicorn
+    python benchmark.py --save baseline.json         # 保存基准结果
+    python benchmark.py --compare baseline.json      # 和基准比较，p95 变慢超过阈值时返回非零
+"""
+import argparse
+import atexit
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# image_derivatives.py 是缩略图进程池导入的模块，gunicorn.conf.py 是 gunicorn 启动时读取的配置，
+# 缺了它们测的就不是部署时的配置，所以都必须存在
+COPY_FILES = ['app.py', 'image_derivatives.py', 'gunicorn.conf.py', 'data.json', 'stats.json']
+COPY_DIRS = ['templates', 'static']
+BLOB_COUNT = 20  # 目录里的文件记录共享这么多个真实存储文件
+UPLOAD_SIZE = 64 * 1024
+CHUNKED_UPLOAD_SIZE = 3 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def prepare_workdir():
+    """把应用复制到临时目录，基准测试不会碰仓库里的数据"""
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    for name in COPY_FILES:
+        shutil.copy(os.path.join(REPO_DIR, name), workdir)
+    for name in COPY_DIRS:
+        shutil.copytree(os.path.join(REPO_DIR, name), os.path.join(workdir, name),
+                        ignore=shutil.ignore_patterns('files', 'uploads', '__pycache__'))
+    os.makedirs(os.path.join(workdir, 'static', 'files'))
+    os.makedirs(os.path.join(workdir, 'static', 'uploads'))
+    return workdir
+
+
+def populate(app_module, target, blobs):
+    """往文件目录里补充记录直到 target 条，记录轮流指向 blobs 里的存储文件"""
+    catalog = app_module.files_catalog
+    current = len(catalog.all())
+    batch = []
+    for i in range(current, target):
+        name, size = blobs[i % len(blobs)]
+        batch.append({
+            'id': str(uuid.uuid4()),
+            'original_name': f'document-{i}.pdf',
+            'filename': name,
+            'relative_path': name,
+            'folder': f'folder-{i % 10}' if i % 3 else None,
+            'description': f'基准测试文件 {i}',
+            'size': size,
+            'upload_date': datetime.fromtimestamp(1700000000 + i * 60).strftime('%Y-%m-%d %H:%M:%S'),
+            'type': 'pdf',
+            'downloads': i % 97
+        })
+        if len(batch) >= 5000:
+            catalog.add_many(batch)
+            batch = []
+    if batch:
+        catalog.add_many(batch)
+
+
+def create_blobs(files_folder):
+    blobs = []
+    for i in range(BLOB_COUNT):
+        raw = os.urandom(256 * 1024 if i % 2 else 16 * 1024)
+        name = f'{uuid.uuid4().hex}.pdf'
+        with open(os.path.join(files_folder, name), 'wb') as f:
+            f.write(raw)
+        blobs.append((name, len(raw)))
+    return blobs
+
+
+def multipart(field, filename, raw):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8') + raw + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class TestClient:
+    """用 Flask 测试客户端发请求（不经过网络和 WSGI 服务器）"""
+
+    def __init__(self, app_module):
+        self.client = app_module.app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, data=body, headers=headers or {})
+        data = response.get_data()
+        return response.status_code, data, response.headers
+
+
+class HttpClient:
+    """用 http.client 向本地 gunicorn 发请求，每个线程一个长连接"""
+
+    def __init__(self, port, cookie=None):
+        self.port = port
+        self.cookie = cookie
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                return response.status, response.read(), response.headers
+            except (http.client.HTTPException, ConnectionError):
+                # 服务器关闭了空闲连接，重连一次
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+
+def login(client, password):
+    status, _, headers = client.request('POST', '/api/login', json.dumps({'password': password}).encode('utf-8'),
+                                        {'Content-Type': 'application/json'})
+    if status != 200:
+        raise RuntimeError(f'登录失败: {status}')
+    cookie = headers.get('Set-Cookie', '')
+    return cookie.split(';', 1)[0]
+
+
+def build_scenarios(file_ids, blobs):
+    """返回 [(名称, 函数)]，函数发一次（或一组）请求，返回是否成功"""
+    counter = iter(range(10 ** 9))
+
+    def get(path):
+        return lambda client: client.request('GET', path)[0] == 200
+
+    def increment_download(client):
+        file_id = file_ids[next(counter) % len(file_ids)]
+        return client.request('POST', f'/api/files/{file_id}/download')[0] == 200
+
+    def upload(client):
+        body, content_type = multipart('files', f'bench-{uuid.uuid4().hex[:8]}.pdf', os.urandom(UPLOAD_SIZE))
+        return client.request('POST', '/api/files', body, {'Content-Type': content_type})[0] == 200
+
+    def chunked_upload(client):
+        raw = os.urandom(CHUNKED_UPLOAD_SIZE)
+        status, body, _ = client.request('POST', '/api/files/uploads', json.dumps({
+            'filename': f'bench-{uuid.uuid4().hex[:8]}.zip', 'size': len(raw)}).encode('utf-8'),
+            {'Content-Type': 'application/json'})
+        if status != 200:
+            return False
+        upload_id = json.loads(body)['upload_id']
+        for offset in range(0, len(raw), CHUNK_SIZE):
+            status = client.request('PUT', f'/api/files/uploads/{upload_id}?offset={offset}',
+                                    raw[offset:offset + CHUNK_SIZE],
+                                    {'Content-Type': 'application/octet-stream'})[0]
+            if status != 200:
+                return False
+        return client.request('POST', f'/api/files/uploads/{upload_id}/complete')[0] == 200
+
+    return [
+        ('index', get('/')),
+        ('data_json', get('/data.json')),
+        ('files_full_list', get('/api/files')),
+        ('files_page', get('/api/files?limit=50')),
+        ('files_page_sorted', get('/api/files?limit=50&sort=downloads&folder=folder-3')),
+        ('download', get(f'/files/{blobs[0][0]}')),
+        ('increment_download', increment_download),
+        ('upload', upload),
+        ('chunked_upload', chunked_upload),
+    ]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(client, func, requests, concurrency, warmup):
+    for _ in range(warmup):
+        func(client)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = func(client)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+    else:
+        for i in range(requests):
+            one(i)
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / wall, 1) if wall else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workdir, args):
+    port = free_port()
+    env = dict(os.environ, FILES_BACKEND=args.backend)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(args.workers), '--threads', str(args.threads), '--timeout', '120'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn 启动失败（是否已安装 gunicorn？）')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('等待 gunicorn 启动超时')
+
+
+def print_table(title, results):
+    print(f'\n{title}')
+    print(f"{'场景':<22}{'请求数':>8}{'错误':>6}{'吞吐(req/s)':>14}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['requests']:>8}{r['errors']:>6}{r['throughput_rps']:>14}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def compare(report, baseline, threshold):
+    """p95 比基准慢超过 threshold（比例）的场景算回退，返回回退列表"""
+    regressions = []
+    print(f'\n与基准比较（p95，阈值 +{threshold:.0%}）')
+    for size, modes in report['results'].items():
+        for mode, scenarios in modes.items():
+            for name, r in scenarios.items():
+                base = baseline.get('results', {}).get(size, {}).get(mode, {}).get(name)
+                if not base or not base['p95_ms']:
+                    continue
+                change = r['p95_ms'] / base['p95_ms'] - 1
+                flag = ''
+                if change > threshold:
+                    flag = '  <-- 回退'
+                    regressions.append(f'{size}/{mode}/{name}')
+                print(f"{size:>8} {mode:<12}{name:<22}{base['p95_ms']:>10} -> {r['p95_ms']:<10}{change:+.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地性能基准测试')
+    parser.add_argument('--sizes', default='100,10000', help='文件目录的记录数，逗号分隔，从小到大依次测试')
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    parser.add_argument('--warmup', type=int, default=5, help='每个场景正式计时前的预热请求数')
+    parser.add_argument('--backend', default=os.environ.get('FILES_BACKEND', 'sqlite'), choices=['sqlite', 'json'])
+    parser.add_argument('--scenarios', help='只运行这些场景，逗号分隔')
+    parser.add_argument('--gunicorn', action='store_true', help='同时用本地 gunicorn 和并发负载测试')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8, help='gunicorn 测试的并发连接数')
+    parser.add_argument('--save', help='把结果保存为 JSON 基准')
+    parser.add_argument('--compare', help='和之前保存的 JSON 基准比较')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 变慢超过这个比例算回退')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+    save_path = os.path.abspath(args.save) if args.save else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    workdir = prepare_workdir()
+    if args.keep:
+        print(f'临时目录: {workdir}')
+    else:
+        # 先于 app 注册，退出时在 app 的写缓冲落盘之后才删除
+        atexit.register(shutil.rmtree, workdir, True)
+    os.environ['FILES_BACKEND'] = args.backend
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import app as app_module
+
+    blobs = create_blobs(app_module.app.config['FILES_FOLDER'])
+    password = app_module.read_data()['admin_password']
+    report = {
+        'meta': {
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'requests': args.requests,
+            'gunicorn': {'workers': args.workers, 'threads': args.threads,
+                         'concurrency': args.concurrency} if args.gunicorn else None
+        },
+        'results': {}
+    }
+    for size in sizes:
+        print(f'\n准备 {size} 个文件记录...')
+        populate(app_module, size, blobs)
+        file_ids = [f['id'] for f in app_module.files_catalog.page(limit=200)[0]]
+        scenarios = build_scenarios(file_ids, blobs)
+        if args.scenarios:
+            wanted = set(args.scenarios.split(','))
+            scenarios = [s for s in scenarios if s[0] in wanted]
+        results = report['results'][str(size)] = {}
+
+        client = TestClient(app_module)
+        login(client, password)
+        results['test_client'] = {name: run_scenario(client, func, args.requests, 1, args.warmup)
+                                  for name, func in scenarios}
+        print_table(f'{size} 个文件 - Flask 测试客户端', results['test_client'])
+
+        if args.gunicorn:
+            # 后台写缓冲先落盘，gunicorn 的 worker 才能看到一致的数据
+            app_module.download_counter.flush()
+            process, port = start_gunicorn(workdir, args)
+            try:
+                client = HttpClient(port)
+                client.cookie = login(client, password)
+                results['gunicorn'] = {name: run_scenario(client, func, args.requests, args.concurrency, args.warmup)
+                                       for name, func in scenarios}
+            finally:
+                process.terminate()
+                process.wait()
+            print_table(f'{size} 个文件 - gunicorn（{args.workers} worker x {args.threads} 线程，并发 {args.concurrency}）',
+                        results['gunicorn'])
+
+    if save_path:
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已保存到 {save_path}')
+    if compare_path:
+        with open(compare_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n性能回退: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
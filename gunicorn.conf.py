@@ -0,0 +1,10 @@
+"""gunicorn 配置（gunicorn 启动时自动读取当前目录下的这个文件）"""
+import os
+import shutil
+
+METRICS_FOLDER = os.path.join('.cache', 'metrics')  # 和 app.py 里的 METRICS_FOLDER 一致
+
+
+def on_starting(server):
+    # 监控指标从 0 开始计数，上次运行的 worker 文件不再需要；Prometheus 会把归零识别为一次重启
+    shutil.rmtree(METRICS_FOLDER, ignore_errors=True)
@@ -0,0 +1,25 @@
+"""生成图片缩略图，在 app.py 的进程池里运行
+
+单独放在这个模块里，进程池的子进程只需要导入它和 Pillow，
+不会再导入一遍 app（初始化数据、打开数据库、启动后台线程等）。
+"""
+import os
+
+from PIL import Image
+
+
+def build_image_derivatives(source, targets):
+    """按 targets [(宽度, 输出路径, 格式)] 生成缩略图"""
+    with Image.open(source) as image:
+        image.load()
+        for width, dest, fmt in targets:
+            # 原图比目标宽度还窄时不放大，只转换格式
+            resized = image
+            if width < image.width:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS)
+            if fmt == 'JPEG' and resized.mode not in ('RGB', 'L'):
+                resized = resized.convert('RGB')
+            tmp_path = f'{dest}.{os.getpid()}.tmp'
+            resized.save(tmp_path, fmt, quality=82)
+            os.replace(tmp_path, dest)
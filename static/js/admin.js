@@ -57,36 +57,55 @@ function showToast(message, type) {
 }
 
 // Load files list
-async function loadFilesList() {
+const ADMIN_FILES_PAGE_SIZE = 50;
+
+function renderFileRow(file) {
+    return `
+        <tr>
+            <td>${file.name || file.original_name || file.filename || '未知'}</td>
+            <td>${file.description || '-'}</td>
+            <td>${file.folder || '-'}</td>
+            <td>
+                <button type="button" class="btn btn-sm btn-danger" onclick="deleteFile('${file.id || file.filename}')">删除</button>
+            </td>
+        </tr>
+    `;
+}
+
+async function loadFilesList(cursor) {
     try {
-        const response = await fetch('/api/files');
-        const files = await response.json();
+        let url = `/api/files?limit=${ADMIN_FILES_PAGE_SIZE}`;
+        if (cursor) {
+            url += `&cursor=${encodeURIComponent(cursor)}`;
+        }
+        const response = await fetch(url);
+        const page = await response.json();
+        const files = page.items;
         
         const filesList = document.getElementById('filesList');
         if (!filesList) return;
         
-        if (!files || files.length === 0) {
+        const moreButton = document.getElementById('filesLoadMore');
+        if (moreButton) moreButton.remove();
+        
+        if (cursor) {
+            // 追加下一页
+            filesList.querySelector('tbody').insertAdjacentHTML('beforeend', files.map(renderFileRow).join(''));
+        } else if (!files || files.length === 0) {
             filesList.innerHTML = '<p>暂无文件</p>';
             return;
+        } else {
+            let html = `<p>共 ${page.total} 个文件</p>`;
+            html += '<table class="files-table"><thead><tr><th>文件名</th><th>描述</th><th>文件夹</th><th>操作</th></tr></thead><tbody>';
+            html += files.map(renderFileRow).join('');
+            html += '</tbody></table>';
+            filesList.innerHTML = html;
         }
         
-        let html = '<table class="files-table"><thead><tr><th>文件名</th><th>描述</th><th>文件夹</th><th>操作</th></tr></thead><tbody>';
-        
-        files.forEach(file => {
-            html += `
-                <tr>
-                    <td>${file.name || file.filename || '未知'}</td>
-                    <td>${file.description || '-'}</td>
-                    <td>${file.folder || '-'}</td>
-                    <td>
-                        <button type="button" class="btn btn-sm btn-danger" onclick="deleteFile('${file.id || file.filename}')">删除</button>
-                    </td>
-                </tr>
-            `;
-        });
-        
-        html += '</tbody></table>';
-        filesList.innerHTML = html;
+        if (page.next_cursor) {
+            filesList.insertAdjacentHTML('beforeend',
+                `<button type="button" id="filesLoadMore" class="btn btn-secondary" data-cursor="${page.next_cursor}" onclick="loadFilesList(this.dataset.cursor)">加载更多</button>`);
+        }
     } catch (error) {
         console.error('加载文件列表失败', error);
     }
@@ -123,11 +142,73 @@ async function loadStats() {
             });
             visitorLogs.innerHTML = html;
         }
+        
+        // 今日访问量和独立访客（按天汇总的访问分析）
+        const today = new Date();
+        today.setHours(0, 0, 0, 0);
+        const todayResponse = await fetch(`/api/stats?start=${Math.floor(today.getTime() / 1000)}&granularity=day`);
+        if (todayResponse.ok) {
+            const todayStats = await todayResponse.json();
+            const todayVisits = document.getElementById('todayVisits');
+            const todayUniqueVisitors = document.getElementById('todayUniqueVisitors');
+            if (todayVisits) todayVisits.textContent = todayStats.visits || 0;
+            if (todayUniqueVisitors) todayUniqueVisitors.textContent = todayStats.unique_visitors || 0;
+        }
     } catch (error) {
         console.error('加载统计数据失败', error);
     }
 }
 
+// 分块上传大文件：每块失败时查询服务器已收到的位置，从那里继续
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+
+async function uploadFileInChunks(file, folder, description) {
+    const initResponse = await fetch('/api/files/uploads', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size, folder, description})
+    });
+    const init = await initResponse.json();
+    if (!init.success) {
+        throw new Error(init.message || '上传失败');
+    }
+    
+    let offset = 0;
+    let retries = 0;
+    while (offset < file.size) {
+        const chunk = file.slice(offset, offset + init.chunk_size);
+        try {
+            const response = await fetch(`/api/files/uploads/${init.upload_id}?offset=${offset}`, {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/octet-stream'},
+                body: chunk
+            });
+            const result = await response.json();
+            if (!result.success && response.status !== 409) {
+                throw new Error(result.message || '上传失败');
+            }
+            offset = result.offset;
+            retries = 0;
+        } catch (error) {
+            if (++retries > 5) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            const status = await fetch(`/api/files/uploads/${init.upload_id}`).then(r => r.json());
+            if (status.success) {
+                offset = status.offset;
+            }
+        }
+    }
+    
+    const completeResponse = await fetch(`/api/files/uploads/${init.upload_id}/complete`, {method: 'POST'});
+    const completed = await completeResponse.json();
+    if (!completed.success) {
+        throw new Error(completed.message || '上传失败');
+    }
+    return completed.file;
+}
+
 // Delete file
 async function deleteFile(fileId) {
     if (!confirm('确定要删除这个文件吗？')) return;
@@ -349,35 +430,86 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
-            const formData = new FormData();
-            for (let i = 0; i < files.length; i++) {
-                formData.append('files', files[i]);
+            const folder = fileFolder ? fileFolder.value : '';
+            const description = fileDescription ? fileDescription.value : '';
+            
+            // 大文件走分块上传（断线可续传），小文件一次性批量上传
+            const smallFiles = [...files].filter(file => file.size <= CHUNKED_UPLOAD_THRESHOLD);
+            const largeFiles = [...files].filter(file => file.size > CHUNKED_UPLOAD_THRESHOLD);
+            
+            try {
+                for (const file of largeFiles) {
+                    showToast(`正在上传 ${file.name}...`, 'info');
+                    await uploadFileInChunks(file, folder, description);
+                }
+                
+                let data = {success: true};
+                if (smallFiles.length > 0) {
+                    const formData = new FormData();
+                    smallFiles.forEach(file => formData.append('files', file));
+                    if (folder) {
+                        formData.append('folder', folder);
+                    }
+                    if (description) {
+                        formData.append('description', description);
+                    }
+                    
+                    const response = await fetch('/api/files', {
+                        method: 'POST',
+                        body: formData
+                    });
+                    data = await response.json();
+                }
+                
+                if (data.success) {
+                    showToast('文件上传成功', 'success');
+                    fileInput.value = '';
+                    if (fileFolder) fileFolder.value = '';
+                    if (fileDescription) fileDescription.value = '';
+                    loadFilesList();
+                } else {
+                    showToast(data.message || '上传失败', 'error');
+                }
+            } catch (error) {
+                showToast(error.message || '上传失败', 'error');
             }
-            if (fileFolder && fileFolder.value) {
-                formData.append('folder', fileFolder.value);
+        });
+    }
+    
+    // 从备份恢复
+    const backupRestoreForm = document.getElementById('backupRestoreForm');
+    if (backupRestoreForm) {
+        backupRestoreForm.addEventListener('submit', async function(e) {
+            e.preventDefault();
+            
+            const backupFile = document.getElementById('backupFile');
+            if (!backupFile.files || backupFile.files.length === 0) {
+                showToast('请选择备份文件', 'error');
+                return;
             }
-            if (fileDescription && fileDescription.value) {
-                formData.append('description', fileDescription.value);
+            if (!confirm('恢复会覆盖当前的数据和文件列表，确定继续吗？')) {
+                return;
             }
             
+            const formData = new FormData();
+            formData.append('backup', backupFile.files[0]);
             try {
-                const response = await fetch('/api/files', {
+                showToast('正在恢复备份...', 'info');
+                const response = await fetch('/api/backup', {
                     method: 'POST',
                     body: formData
                 });
-                
                 const data = await response.json();
                 if (data.success) {
-                    showToast('文件上传成功', 'success');
-                    fileInput.value = '';
-                    if (fileFolder) fileFolder.value = '';
-                    if (fileDescription) fileDescription.value = '';
+                    showToast(data.message, 'success');
+                    backupFile.value = '';
+                    loadData();
                     loadFilesList();
                 } else {
-                    showToast(data.message || '上传失败', 'error');
+                    showToast(data.message || '恢复失败', 'error');
                 }
             } catch (error) {
-                showToast('上传失败', 'error');
+                showToast(error.message || '恢复失败', 'error');
             }
         });
     }
@@ -1,17 +1,24 @@
 // 页面数据和配置
 let pageData = {};
+let pageDataEtag = null;  // 数据版本，局部修改时通过 If-Match 提交
 
 // 初始化页面
 async function initPage() {
     const loading = document.getElementById('loading');
     
     try {
-        // 从data.json文件加载数据，添加时间戳防止缓存
-        const response = await fetch('/data.json?t=' + Date.now());
-        if (!response.ok) {
-            throw new Error(`无法加载数据: ${response.status} ${response.statusText}`);
+        if (window.STATIC_SITE) {
+            // 静态导出的页面：数据已经内联在页面里
+            pageData = window.pageData;
+        } else {
+            // 从data.json文件加载数据（服务器返回ETag，浏览器会自动用If-None-Match重新验证）
+            const response = await fetch('/data.json');
+            if (!response.ok) {
+                throw new Error(`无法加载数据: ${response.status} ${response.statusText}`);
+            }
+            pageData = await response.json();
+            pageDataEtag = response.headers.get('ETag');
         }
-        pageData = await response.json();
         
         console.log('页面数据加载成功:', pageData);
         
@@ -34,6 +41,9 @@ async function initPage() {
         
         // 初始化模块拖动编辑
         initModuleDragAndDrop();
+        
+        // 订阅内容变化推送
+        initLiveUpdates();
     } catch (error) {
         console.error('初始化页面失败:', error);
         if (loading) {
@@ -48,6 +58,112 @@ async function initPage() {
     }
 }
 
+// 内容变化推送：保存后服务器通过 SSE 发来变化的字段和 JSON Patch，直接应用后重新渲染
+function applyJsonPatch(doc, patch) {
+    patch.forEach(operation => {
+        const tokens = operation.path.split('/').slice(1).map(token => token.replace(/~1/g, '/').replace(/~0/g, '~'));
+        const key = tokens.pop();
+        let parent = doc;
+        tokens.forEach(token => {
+            if (typeof parent[token] !== 'object' || parent[token] === null) {
+                parent[token] = {};
+            }
+            parent = parent[token];
+        });
+        if (operation.op === 'remove') {
+            delete parent[key];
+        } else {
+            parent[key] = operation.value;
+        }
+    });
+}
+
+async function refreshModules() {
+    const container = document.getElementById('modules-container');
+    const moduleOrder = (pageData.layout || {}).module_order || ['hero', 'files'];
+    const modules = [];
+    for (const moduleName of moduleOrder) {
+        try {
+            const module = await createModule(moduleName);
+            if (module) {
+                modules.push(module);
+            }
+        } catch (error) {
+            console.error(`加载模块 ${moduleName} 失败:`, error);
+        }
+    }
+    container.replaceChildren(...modules);
+    initDragAndDrop();
+    initModuleDragAndDrop();
+}
+
+async function refreshFilesModule() {
+    const current = document.getElementById('module-files');
+    if (!current) return;
+    const module = await createModule('files');
+    current.replaceWith(module);
+    initDragAndDrop();
+    initModuleDragAndDrop();
+}
+
+function initLiveUpdates() {
+    // 静态导出的页面没有后端，内容变化时会重新导出；服务器没有开启推送时不订阅
+    if (!window.EventSource || window.STATIC_SITE || !window.LIVE_UPDATES) return;
+    const source = new EventSource('/api/events');
+    
+    source.addEventListener('change', async event => {
+        const change = JSON.parse(event.data);
+        try {
+            if (change.reload) {
+                const response = await fetch('/data.json');
+                pageData = await response.json();
+                pageDataEtag = response.headers.get('ETag');
+            } else {
+                applyJsonPatch(pageData, change.patch || []);
+                // 事件 id 是 "<数据版本>.<文件目录版本>"
+                pageDataEtag = `"${event.lastEventId.split('.')[0]}"`;
+            }
+            
+            const sections = change.sections || [];
+            if (sections.includes('*') || sections.includes('theme')) {
+                applyTheme();
+            }
+            if (draggedModule) {
+                return;  // 正在拖动模块时不重新渲染
+            }
+            if (sections.some(section => !['theme', 'files'].includes(section))) {
+                await refreshModules();
+            } else if (sections.includes('files')) {
+                await refreshFilesModule();
+            }
+        } catch (error) {
+            console.error('应用内容更新失败:', error);
+        }
+    });
+    
+    // 服务器推送连接已满（503）时浏览器不会自动重连，稍后再试
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(initLiveUpdates, 30000);
+        }
+    };
+}
+
+// 上传的图片可以通过 ?w= 取服务器生成的缩略图（320/640/1280）
+function resizedImageUrl(url, width) {
+    if (!url || !url.startsWith('/static/uploads/')) {
+        return url;
+    }
+    return `${url}?w=${width}`;
+}
+
+function imageSrcset(url) {
+    if (!url || !url.startsWith('/static/uploads/')) {
+        return '';
+    }
+    return [320, 640, 1280].map(width => `${resizedImageUrl(url, width)} ${width}w`).join(', ');
+}
+
 // 应用主题
 function applyTheme() {
     const theme = pageData.theme || {};
@@ -56,7 +172,9 @@ function applyTheme() {
     // 设置背景
     if (theme.background_type === 'image' && theme.background_image) {
         body.className = 'bg-image';
-        body.style.backgroundImage = `url(${theme.background_image})`;
+        const backgroundWidth = window.innerWidth * (window.devicePixelRatio || 1) <= 1280 ? 1280 : 0;
+        const backgroundUrl = backgroundWidth ? resizedImageUrl(theme.background_image, backgroundWidth) : theme.background_image;
+        body.style.backgroundImage = `url(${backgroundUrl})`;
     } else if (theme.background_type === 'solid') {
         body.className = 'bg-solid';
         body.style.setProperty('--bg-color', theme.background_color || '#667eea');
@@ -146,7 +264,7 @@ function createHeroModule() {
         <div class="hero">
             <div class="container">
                 <div class="hero-content">
-                    <img src="${avatarUrl}"
+                    <img src="${resizedImageUrl(avatarUrl, 320)}"
                          alt="${profile.name || '用户头像'}"
                          class="avatar interactive-avatar"
                          data-full-size="${profile.avatar || 'https://placehold.co/160'}"
@@ -270,7 +388,10 @@ function createProjectsModule() {
     const projects = pageData.projects || [];
     let projectsHtml = projects.map(project => `
         <div class="project-card">
-            <img src="${project.image}" 
+            <img src="${resizedImageUrl(project.image, 640)}"
+                 srcset="${imageSrcset(project.image)}"
+                 sizes="(max-width: 640px) 100vw, 400px"
+                 loading="lazy"
                  alt="${project.title}" 
                  class="project-image"
                  onerror="this.src='https://placehold.co/320x220'">
@@ -298,14 +419,65 @@ function createProjectsModule() {
 }
 
 // Files模块
+const FILES_PAGE_SIZE = 24;
+
+async function fetchFilesPage(cursor) {
+    // 静态导出的页面使用导出时生成的完整文件列表
+    if (window.STATIC_SITE) {
+        const files = window.STATIC_SITE.files;
+        return {items: files, next_cursor: null, total: files.length};
+    }
+    // 分页获取文件列表，next_cursor 为空表示已经是最后一页
+    let url = `/api/files?limit=${FILES_PAGE_SIZE}`;
+    if (cursor) {
+        url += `&cursor=${encodeURIComponent(cursor)}`;
+    }
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error('无法加载文件列表');
+    }
+    return response.json();
+}
+
+function renderFileCard(file) {
+    const icon = getFileIcon(file.type);
+    const size = formatFileSize(file.size);
+    const downloadUrl = `/files/${file.relative_path || file.filename}`;
+    
+    return `
+        <div class="file-card">
+            <div class="file-icon">${icon}</div>
+            <div class="file-name">${file.original_name}</div>
+            <div class="file-description">${file.description || '暂无描述'}</div>
+            <div class="file-info">
+                <span>${size}</span>
+                <span>${file.downloads || 0} 次下载</span>
+            </div>
+            <a href="${downloadUrl}"
+               class="file-download-btn"
+               target="_blank"
+               rel="noopener noreferrer"
+               onclick="incrementDownload('${file.id}'); return true;">
+                下载文件
+            </a>
+        </div>
+    `;
+}
+
+function renderLoadMoreButton(cursor) {
+    if (!cursor) return '';
+    return `
+        <div style="text-align: center; margin-top: 2rem;">
+            <button type="button" class="file-download-btn" data-cursor="${cursor}" onclick="loadMoreFiles(this)">加载更多</button>
+        </div>
+    `;
+}
+
 async function createFilesModule() {
     try {
-        // 从API获取文件列表
-        const response = await fetch('/api/files');
-        if (!response.ok) {
-            throw new Error('无法加载文件列表');
-        }
-        const files = await response.json();
+        // 从API获取第一页文件
+        const page = await fetchFilesPage();
+        const files = page.items;
         
         if (!files || files.length === 0) {
             return `
@@ -318,30 +490,7 @@ async function createFilesModule() {
             `;
         }
         
-        let filesHtml = files.map(file => {
-            const icon = getFileIcon(file.type);
-            const size = formatFileSize(file.size);
-            const downloadUrl = `/files/${file.filename}`;
-            
-            return `
-                <div class="file-card">
-                    <div class="file-icon">${icon}</div>
-                    <div class="file-name">${file.original_name}</div>
-                    <div class="file-description">${file.description || '暂无描述'}</div>
-                    <div class="file-info">
-                        <span>${size}</span>
-                        <span>${file.downloads || 0} 次下载</span>
-                    </div>
-                    <a href="${downloadUrl}"
-                       class="file-download-btn"
-                       target="_blank"
-                       rel="noopener noreferrer"
-                       onclick="incrementDownload('${file.id}'); return true;">
-                        下载文件
-                    </a>
-                </div>
-            `;
-        }).join('');
+        const filesHtml = files.map(renderFileCard).join('');
         
         return `
             <section class="section files-section">
@@ -350,6 +499,7 @@ async function createFilesModule() {
                     <div class="files-grid">
                         ${filesHtml}
                     </div>
+                    ${renderLoadMoreButton(page.next_cursor)}
                 </div>
             </section>
         `;
@@ -366,6 +516,26 @@ async function createFilesModule() {
     }
 }
 
+// 加载下一页文件
+async function loadMoreFiles(button) {
+    const wrapper = button.parentElement;
+    const grid = wrapper.parentElement.querySelector('.files-grid');
+    button.disabled = true;
+    try {
+        const page = await fetchFilesPage(button.dataset.cursor);
+        grid.insertAdjacentHTML('beforeend', page.items.map(renderFileCard).join(''));
+        if (page.next_cursor) {
+            button.dataset.cursor = page.next_cursor;
+            button.disabled = false;
+        } else {
+            wrapper.remove();
+        }
+    } catch (error) {
+        console.error('加载更多文件失败:', error);
+        button.disabled = false;
+    }
+}
+
 // 增加下载计数
 async function incrementDownload(fileId) {
     try {
@@ -467,32 +637,6 @@ function handleModuleDrop(e) {
     }
 }
 
-// 保存模块顺序
-async function saveModuleOrder() {
-    const container = document.getElementById('modules-container');
-    const modules = container.querySelectorAll('.module');
-    const newOrder = [...modules].map(m => m.dataset.module);
-    
-    try {
-        const response = await fetch('/api/data');
-        const data = await response.json();
-        
-        if (data.layout) {
-            data.layout.module_order = newOrder;
-            
-            await fetch('/api/data', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(data)
-            });
-            
-            console.log('模块顺序已保存:', newOrder);
-        }
-    } catch (error) {
-        console.error('保存模块顺序失败:', error);
-    }
-}
-
 // 初始化拖拽功能
 function initDragAndDrop() {
     const container = document.getElementById('modules-container');
@@ -572,7 +716,7 @@ function handleDrop(e) {
     return false;
 }
 
-// 保存模块顺序
+// 保存模块顺序（JSON Patch 只提交 layout.module_order）
 async function saveModuleOrder() {
     try {
         const modules = document.querySelectorAll('.module');
@@ -583,18 +727,24 @@ async function saveModuleOrder() {
             moduleOrder.push(id);
         });
 
+        const headers = {'Content-Type': 'application/json-patch+json'};
+        if (pageDataEtag) {
+            headers['If-Match'] = pageDataEtag;
+        }
         const response = await fetch('/api/data', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                module_order: moduleOrder
-            })
+            method: 'PATCH',
+            headers: headers,
+            body: JSON.stringify([
+                {op: 'add', path: '/layout/module_order', value: moduleOrder}
+            ])
         });
 
-        if (!response.ok) {
+        if (response.status === 412) {
+            alert('数据已在其他页面修改，请刷新后重试');
+        } else if (!response.ok) {
             console.error('保存模块顺序失败');
+        } else {
+            pageDataEtag = response.headers.get('ETag');
         }
     } catch (error) {
         console.error('保存模块顺序出错:', error);
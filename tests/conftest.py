@@ -0,0 +1,57 @@
+"""测试共用的 fixture：在临时目录里运行一份 app 的副本，不往源码目录里写任何文件"""
+import atexit
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COPY_FILES = ['app.py', 'image_derivatives.py', 'data.json']
+COPY_DIRS = ['templates', 'static']
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    # app 在当前目录读写 data.json、.cache 等文件，静态目录是 app.py 旁边的 static/，
+    # 所以连同 app.py 一起复制到临时目录，导入时构建的 static/build 也落在那里
+    for name in COPY_FILES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    for name in COPY_DIRS:
+        shutil.copytree(os.path.join(ROOT, name), os.path.join(tmp_path, name),
+                        ignore=shutil.ignore_patterns('build', 'files', 'uploads', '__pycache__'))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv('FILES_BACKEND', 'sqlite')
+    for name in ('app', 'image_derivatives'):
+        sys.modules.pop(name, None)
+    module = importlib.import_module('app')
+    assert module.app.static_folder == os.path.join(str(tmp_path), 'static')
+    module.app.config['TESTING'] = True
+    yield module
+
+    # 在切回原来的目录之前停掉后台线程、写完缓冲，再取消退出时的 flush（它们使用相对路径）
+    for worker in (module.metrics, module.visit_counter, module.download_counter,
+                   module.static_exporter, module.file_scanner):
+        worker.stop()
+    for flush in (module.visit_counter.flush, module.download_counter.flush, module.metrics.flush):
+        flush()
+        atexit.unregister(flush)
+    if module._derivative_pool is not None:
+        module._derivative_pool.shutdown()
+    for name in ('app', 'image_derivatives'):
+        sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    return client
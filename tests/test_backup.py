@@ -0,0 +1,74 @@
+"""ZIP 导出和备份恢复"""
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+
+def add_file(app_module, folder='docs', name='a.txt', content=b'hello'):
+    file_info = app_module.build_file_info(name, hashlib.sha256(content).hexdigest()[:32], len(content), folder, '')
+    with open(os.path.join(app_module.FILES_FOLDER, file_info['filename']), 'wb') as f:
+        f.write(content)
+    app_module.files_catalog.add_many([file_info])
+    return file_info
+
+
+def test_folder_export_requires_login(app_module, client, admin_client):
+    add_file(app_module)
+    assert client.get('/api/files/export?folder=docs').status_code == 401
+
+    response = admin_client.get('/api/files/export?folder=docs')
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.read('a.txt') == b'hello'
+
+
+def backup_zip(data, files, members=()):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as archive:
+        archive.writestr('data.json', json.dumps(data))
+        archive.writestr('files.json', json.dumps(files))
+        for name, content in members:
+            archive.writestr(name, content)
+    return buf.getvalue()
+
+
+def test_backup_round_trip(app_module, admin_client):
+    file_info = add_file(app_module, content=b'round trip')
+    password = app_module.read_data()['admin_password']
+    backup = admin_client.get('/api/backup').data
+
+    app_module.files_catalog.replace_all([])
+    os.remove(os.path.join(app_module.FILES_FOLDER, file_info['filename']))
+    response = admin_client.post('/api/backup', data=backup, content_type='application/zip')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['files'] == 1
+    assert app_module.files_catalog.get(file_info['id'])['original_name'] == 'a.txt'
+    with open(os.path.join(app_module.FILES_FOLDER, file_info['filename']), 'rb') as f:
+        assert f.read() == b'round trip'
+    assert app_module.read_data()['admin_password'] == password
+
+
+@pytest.mark.parametrize('bad', [
+    {'original_name': None},
+    {'original_name': ''},
+    {'filename': 5},
+    {'size': 'big'},
+    {'folder': ['x']},
+])
+def test_backup_with_invalid_file_record_writes_nothing(app_module, admin_client, bad):
+    file_info = dict(add_file(app_module), **bad)
+    if bad.get('original_name') is None and 'original_name' in bad:
+        del file_info['original_name']
+    before = app_module.files_catalog.all()
+    data = dict(app_module.read_data(), profile={'name': 'restored'})
+    backup = backup_zip(data, [file_info], [('uploads/new.png', b'png')])
+
+    response = admin_client.post('/api/backup', data=backup, content_type='application/zip')
+    assert response.status_code == 400
+    assert app_module.files_catalog.all() == before
+    assert not os.path.exists(os.path.join(app_module.UPLOAD_FOLDER, 'new.png'))
+    assert app_module.read_data()['profile']['name'] != 'restored'
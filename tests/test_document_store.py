@@ -0,0 +1,128 @@
+"""DocumentStore：快照 + 追加日志的回放、作废、半行截断和压缩"""
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def paths(tmp_path):
+    snapshot = tmp_path / 'doc.json'
+    snapshot.write_text(json.dumps({'title': 'a', 'items': [1, 2], 'nested': {'x': 1}}), encoding='utf-8')
+    return str(snapshot), str(tmp_path / 'doc.journal')
+
+
+def open_store(app_module, paths, **kwargs):
+    return app_module.DocumentStore(*paths, **kwargs)
+
+
+def test_saves_append_to_journal_and_replay_in_a_new_store(app_module, paths):
+    snapshot_before = open(paths[0], 'rb').read()
+    store = open_store(app_module, paths)
+    doc = store.load()
+    doc['title'] = 'b'
+    doc['nested']['y'] = 2
+    del doc['items']
+    store.save(doc)
+
+    assert open(paths[0], 'rb').read() == snapshot_before
+    lines = open(paths[1], 'rb').read().splitlines()
+    assert len(lines) == 2  # 快照头 + 一条修改记录
+    assert 'base' in json.loads(lines[0])
+
+    fresh = open_store(app_module, paths)
+    assert fresh.read() == {'title': 'b', 'nested': {'x': 1, 'y': 2}}
+    assert fresh.etag == store.etag
+
+
+def test_other_store_sees_appended_changes(app_module, paths):
+    writer = open_store(app_module, paths)
+    reader = open_store(app_module, paths)
+    assert reader.read()['title'] == 'a'
+    for title in ('b', 'c'):
+        doc = writer.load()
+        doc['title'] = title
+        writer.save(doc)
+        assert reader.read()['title'] == title
+    assert reader.etag == writer.etag
+
+
+def test_journal_for_a_replaced_snapshot_is_discarded(app_module, paths):
+    store = open_store(app_module, paths)
+    doc = store.load()
+    doc['title'] = 'from journal'
+    store.save(doc)
+
+    # 手工编辑（或部署）替换了快照，旧日志基于的快照已经不存在
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        json.dump({'title': 'edited', 'items': []}, f)
+    assert open_store(app_module, paths).read() == {'title': 'edited', 'items': []}
+    assert store.read()['title'] == 'edited'
+
+    # 下一次保存重新写日志头，旧记录不会再被回放
+    doc = store.load()
+    doc['items'] = [3]
+    store.save(doc)
+    assert open_store(app_module, paths).read() == {'title': 'edited', 'items': [3]}
+
+
+def test_journal_with_mismatched_header_is_ignored(app_module, paths):
+    with open(paths[1], 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'base': 'not-this-snapshot'}) + '\n')
+        f.write(json.dumps([['set', ['title'], 'stale']]) + '\n')
+    assert open_store(app_module, paths).read()['title'] == 'a'
+
+
+def test_torn_last_line_is_ignored_and_truncated_on_next_save(app_module, paths):
+    store = open_store(app_module, paths)
+    doc = store.load()
+    doc['title'] = 'b'
+    store.save(doc)
+    # 模拟写到一半崩溃：最后一行没有换行符
+    with open(paths[1], 'ab') as f:
+        f.write(b'[["set",["title"],"tor')
+
+    fresh = open_store(app_module, paths)
+    assert fresh.read()['title'] == 'b'
+    doc = fresh.load()
+    doc['title'] = 'c'
+    fresh.save(doc)
+
+    lines = open(paths[1], 'rb').read().splitlines()
+    assert all(json.loads(line) for line in lines)
+    assert open_store(app_module, paths).read()['title'] == 'c'
+
+
+def test_compaction_with_two_stores_alternating_writes(app_module, paths):
+    stores = [open_store(app_module, paths, compact_every=3) for _ in range(2)]
+    for i in range(10):
+        store = stores[i % 2]
+        doc = store.load()
+        doc[f'key{i}'] = i
+        store.save(doc)
+
+    expected = {f'key{i}': i for i in range(10)}
+    for store in stores + [open_store(app_module, paths)]:
+        assert {k: v for k, v in store.read().items() if k.startswith('key')} == expected
+    # 压缩过：快照里已经有前面的修改，日志只剩最后几条
+    with open(paths[0], 'r', encoding='utf-8') as f:
+        assert f.read().count('"key') >= 9
+    assert len(open(paths[1], 'rb').read().splitlines()) <= 3
+
+
+def test_compaction_fsyncs_snapshot_before_truncating_journal(app_module, paths, monkeypatch):
+    store = open_store(app_module, paths)
+    doc = store.load()
+    doc['title'] = 'b'
+    store.save(doc)
+
+    events = []
+    real_fsync, real_truncate = os.fsync, os.truncate
+    monkeypatch.setattr(app_module.os, 'fsync', lambda fd: (events.append('fsync'), real_fsync(fd))[1])
+    monkeypatch.setattr(app_module.os, 'truncate', lambda p, n: (events.append('truncate'), real_truncate(p, n))[1])
+    store.compact()
+
+    assert events.index('truncate') >= 2  # 临时文件和目录都 fsync 之后才清空日志
+    assert events[:2] == ['fsync', 'fsync']
+    assert open_store(app_module, paths).read()['title'] == 'b'
+    assert os.path.getsize(paths[1]) == 0
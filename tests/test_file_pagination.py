@@ -0,0 +1,120 @@
+"""文件列表的游标分页（JSON 和 SQLite 两种后端）"""
+import base64
+import threading
+
+import pytest
+
+FILE_COUNT = 23
+
+
+def make_files():
+    # 排序字段有大量重复值，翻页时要靠插入顺序区分
+    return [{
+        'id': f'id{i:02d}',
+        'original_name': f'file{i}.txt',
+        'filename': f'file{i}.txt',
+        'folder': 'a' if i % 2 else 'b',
+        'description': '',
+        'size': (i * 7) % 5,
+        'upload_date': f'2024-01-0{i % 4 + 1} 00:00:00',
+        'type': 'txt' if i % 3 else 'pdf',
+        'downloads': i % 3,
+    } for i in range(FILE_COUNT)]
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def catalog(app_module, tmp_path, request):
+    if request.param == 'json':
+        (tmp_path / 'catalog.json').write_text('[]', encoding='utf-8')
+        catalog = app_module.JsonFileCatalog(str(tmp_path / 'catalog.json'))
+    else:
+        catalog = app_module.SqliteFileCatalog(str(tmp_path / 'catalog.db'))
+    catalog.add_many(make_files())
+    return catalog
+
+
+def all_pages(app_module, catalog, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        items, next_cursor, total = catalog.page(cursor=cursor, limit=limit, **kwargs)
+        pages.append((items, total))
+        if next_cursor is None:
+            return pages
+        cursor = app_module.decode_cursor(next_cursor)
+
+
+@pytest.mark.parametrize('sort', ['upload_date', 'downloads', 'size'])
+@pytest.mark.parametrize('descending', [True, False])
+@pytest.mark.parametrize('limit', [1, 4, 50])
+def test_pages_cover_every_file_once_in_order(app_module, catalog, sort, descending, limit):
+    files = make_files()
+    expected = sorted(range(FILE_COUNT), key=lambda i: (files[i][sort], i), reverse=descending)
+    pages = all_pages(app_module, catalog, limit, sort=sort, descending=descending)
+
+    ids = [f['id'] for items, _ in pages for f in items]
+    assert ids == [files[i]['id'] for i in expected]
+    assert all(len(items) == limit for items, _ in pages[:-1])
+    # 总数只在第一页返回
+    assert [total for _, total in pages] == [FILE_COUNT] + [None] * (len(pages) - 1)
+    assert all('_seq' not in f for items, _ in pages for f in items)
+
+
+def test_filters(app_module, catalog):
+    files = make_files()
+    pages = all_pages(app_module, catalog, 3, folder='a', file_type='txt', sort='size', descending=False)
+    expected = [f for f in files if f['folder'] == 'a' and f['type'] == 'txt']
+    assert pages[0][1] == len(expected)
+    assert sorted(f['id'] for items, _ in pages for f in items) == [f['id'] for f in expected]
+
+
+def test_json_backend_pages_while_catalogue_changes(app_module, tmp_path):
+    (tmp_path / 'catalog.json').write_text('[]', encoding='utf-8')
+    catalog = app_module.JsonFileCatalog(str(tmp_path / 'catalog.json'))
+    catalog.add_many(make_files())
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                for sort in app_module.FILE_SORT_FIELDS:
+                    items, _, _ = catalog.page(sort=sort, limit=10)
+                    assert len(items) == 10
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(20):
+        catalog.add_downloads({f'id{i:02d}': 1})
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert errors == []
+
+
+def test_endpoint_pages_and_rejects_bad_cursors(app_module, client):
+    app_module.files_catalog.replace_all(make_files())
+    response = client.get('/api/files?limit=10&sort=downloads&order=asc')
+    assert response.status_code == 200
+    first = response.get_json()
+    assert first['total'] == FILE_COUNT and len(first['items']) == 10
+
+    response = client.get(f"/api/files?limit=10&sort=downloads&order=asc&cursor={first['next_cursor']}")
+    second = response.get_json()
+    assert second['total'] is None
+    assert not {f['id'] for f in first['items']} & {f['id'] for f in second['items']}
+
+    bad_cursors = [
+        'not-base64!',
+        base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+        base64.urlsafe_b64encode(b'[1]').decode(),
+        base64.urlsafe_b64encode(b'["x", "y"]').decode(),
+        app_module.encode_cursor('2024-01-01', 3),  # downloads 排序的游标值必须是数字
+        app_module.encode_cursor(True, 3),
+    ]
+    for cursor in bad_cursors:
+        response = client.get(f'/api/files?limit=10&sort=downloads&cursor={cursor}')
+        assert response.status_code == 400, cursor
+    assert client.get('/api/files?sort=name').status_code == 400
@@ -0,0 +1,101 @@
+"""/files/<path> 的 Range 请求（206、multipart/byteranges、416、If-Range）"""
+import os
+
+import pytest
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def sample(app_module):
+    path = os.path.join(app_module.FILES_FOLDER, 'sample.bin')
+    with open(path, 'wb') as f:
+        f.write(CONTENT)
+    return '/files/sample.bin'
+
+
+@pytest.fixture
+def opened_files(app_module, monkeypatch):
+    """记录 app 里打开的文件，用来检查响应结束后是否都关闭了"""
+    files = []
+
+    def tracking_open(*args, **kwargs):
+        f = open(*args, **kwargs)
+        files.append(f)
+        return f
+
+    monkeypatch.setattr(app_module, 'open', tracking_open, raising=False)
+    return files
+
+
+def test_full_download(client, sample, opened_files):
+    response = client.get(sample, buffered=True)
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+    assert all(f.closed for f in opened_files)
+
+
+def test_single_range(client, sample, opened_files):
+    response = client.get(sample, headers={'Range': 'bytes=10-19'}, buffered=True)
+    assert response.status_code == 206
+    assert response.data == CONTENT[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(CONTENT)}'
+    assert response.headers['Content-Length'] == '10'
+    assert opened_files and all(f.closed for f in opened_files)
+
+
+def test_open_ended_and_suffix_ranges(client, sample):
+    response = client.get(sample, headers={'Range': 'bytes=1000-'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[1000:]
+
+    response = client.get(sample, headers={'Range': 'bytes=-24'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[-24:]
+    assert response.headers['Content-Range'] == f'bytes {len(CONTENT) - 24}-{len(CONTENT) - 1}/{len(CONTENT)}'
+
+
+def test_multiple_ranges(client, sample, opened_files):
+    response = client.get(sample, headers={'Range': 'bytes=0-3,100-103'}, buffered=True)
+    assert response.status_code == 206
+    content_type = response.headers['Content-Type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('boundary=')[1].encode()
+    parts = response.data.split(b'--' + boundary)
+    assert parts[-1] == b'--\r\n'
+    bodies = []
+    for part in parts[1:-1]:
+        headers, body = part.split(b'\r\n\r\n', 1)
+        assert b'Content-Range: bytes ' in headers
+        bodies.append(body[:-2])
+    assert bodies == [CONTENT[0:4], CONTENT[100:104]]
+    assert all(f.closed for f in opened_files)
+
+
+def test_unsatisfiable_range(client, sample):
+    response = client.get(sample, headers={'Range': f'bytes={len(CONTENT)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_if_range(client, sample):
+    etag = client.get(sample).headers['ETag']
+    response = client.get(sample, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == CONTENT[:10]
+
+    # 文件已经变了（ETag 不同）时忽略 Range，返回完整文件
+    response = client.get(sample, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_body_close_closes_file_before_iteration(app_module, sample, opened_files):
+    # 客户端在发送前断开：服务器只调用响应体的 close()，不会迭代
+    with app_module.app.test_request_context(headers={'Range': 'bytes=5-9'}):
+        response = app_module.send_file_ranges(os.path.join(app_module.FILES_FOLDER, 'sample.bin'),
+                                               'application/octet-stream')
+        response.response.close()
+    assert opened_files and all(f.closed for f in opened_files)
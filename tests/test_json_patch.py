@@ -0,0 +1,122 @@
+"""JSON Patch（RFC 6902）和 PATCH /api/data"""
+import pytest
+
+
+def patched(app_module, doc, patch):
+    return app_module.apply_json_patch(doc, patch)
+
+
+def test_add_remove_replace(app_module):
+    doc = {'a': {'b': 1}, 'list': [1, 2]}
+    doc = patched(app_module, doc, [
+        {'op': 'add', 'path': '/a/c', 'value': 2},
+        {'op': 'add', 'path': '/list/1', 'value': 9},
+        {'op': 'add', 'path': '/list/-', 'value': 3},
+        {'op': 'remove', 'path': '/a/b'},
+        {'op': 'replace', 'path': '/list/0', 'value': 0},
+    ])
+    assert doc == {'a': {'c': 2}, 'list': [0, 9, 2, 3]}
+
+
+def test_move_and_copy(app_module):
+    doc = {'a': {'x': [1]}, 'b': {}}
+    doc = patched(app_module, doc, [
+        {'op': 'copy', 'from': '/a/x', 'path': '/b/x'},
+        {'op': 'move', 'from': '/a/x', 'path': '/b/y'},
+    ])
+    assert doc == {'a': {}, 'b': {'x': [1], 'y': [1]}}
+    doc['b']['x'].append(2)
+    assert doc['b']['y'] == [1]  # copy 是独立的副本
+
+
+def test_pointer_escapes(app_module):
+    doc = patched(app_module, {}, [{'op': 'add', 'path': '/a~1b~0c', 'value': 1}])
+    assert doc == {'a/b~c': 1}
+
+
+@pytest.mark.parametrize('patch', [
+    [{'op': 'remove', 'path': '/missing'}],
+    [{'op': 'replace', 'path': '/missing', 'value': 1}],
+    [{'op': 'add', 'path': '/list/5', 'value': 1}],
+    [{'op': 'add', 'path': '/list/01', 'value': 1}],
+    [{'op': 'remove', 'path': '/list/-'}],
+    [{'op': 'move', 'from': '/a', 'path': '/a/b'}],
+    [{'op': 'add', 'path': 'no-slash', 'value': 1}],
+    [{'op': 'add', 'path': '/x'}],
+    [{'op': 'frobnicate', 'path': '/x'}],
+])
+def test_invalid_operations(app_module, patch):
+    with pytest.raises(app_module.JsonPatchError):
+        patched(app_module, {'a': {}, 'list': [1]}, patch)
+
+
+@pytest.mark.parametrize('actual, expected, equal', [
+    (1, 1.0, True),
+    ({'n': [1, 2.5]}, {'n': [1.0, 2.5]}, True),
+    ({'a': 1, 'b': 2}, {'b': 2, 'a': 1}, True),
+    (True, 1, False),
+    (0, False, False),
+    ('1', 1, False),
+    (None, False, False),
+    ([1, 2], [2, 1], False),
+])
+def test_test_operation_uses_json_equality(app_module, actual, expected, equal):
+    patch = [{'op': 'test', 'path': '/v', 'value': expected}]
+    if equal:
+        patched(app_module, {'v': actual}, patch)
+    else:
+        with pytest.raises(app_module.JsonPatchTestFailed):
+            patched(app_module, {'v': actual}, patch)
+
+
+def test_patch_endpoint_requires_login(client):
+    assert client.patch('/api/data', json=[]).status_code == 401
+
+
+def test_patch_endpoint_applies_and_returns_etag(app_module, admin_client):
+    etag = admin_client.get('/api/data').headers['ETag']
+    response = admin_client.patch('/api/data', headers={'If-Match': etag},
+                                  json=[{'op': 'replace', 'path': '/profile/name', 'value': '新名字'}])
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert app_module.read_data()['profile']['name'] == '新名字'
+    assert admin_client.get('/api/data').headers['ETag'] == response.headers['ETag']
+
+
+def test_patch_endpoint_rejects_stale_if_match(app_module, admin_client):
+    etag = admin_client.get('/api/data').headers['ETag']
+    admin_client.patch('/api/data', json=[{'op': 'add', 'path': '/extra', 'value': 1}])
+    response = admin_client.patch('/api/data', headers={'If-Match': etag},
+                                  json=[{'op': 'add', 'path': '/extra', 'value': 2}])
+    assert response.status_code == 412
+    assert response.headers['ETag'] != etag
+    assert app_module.read_data()['extra'] == 1
+
+
+def test_patch_endpoint_failed_test_changes_nothing(app_module, admin_client):
+    response = admin_client.patch('/api/data', json=[
+        {'op': 'replace', 'path': '/profile/name', 'value': 'x'},
+        {'op': 'test', 'path': '/profile/name', 'value': 'y'},
+    ])
+    assert response.status_code == 409
+    assert app_module.read_data()['profile']['name'] != 'x'
+
+
+@pytest.mark.parametrize('operation', [
+    {'op': 'replace', 'path': '/admin_password', 'value': 'x'},
+    {'op': 'remove', 'path': '/admin_password'},
+    {'op': 'copy', 'from': '/admin_password', 'path': '/leak'},
+    {'op': 'test', 'path': '/admin_password', 'value': 'admin123'},
+])
+def test_patch_endpoint_forbids_admin_password(app_module, admin_client, operation):
+    password = app_module.read_data().get('admin_password')
+    assert admin_client.patch('/api/data', json=[operation]).status_code == 403
+    assert app_module.read_data().get('admin_password') == password
+    assert 'leak' not in app_module.read_data()
+
+
+def test_patch_endpoint_keeps_password_on_root_replace(app_module, admin_client):
+    password = app_module.read_data().get('admin_password')
+    response = admin_client.patch('/api/data', json=[{'op': 'replace', 'path': '', 'value': {'profile': {}}}])
+    assert response.status_code == 200
+    assert app_module.read_data()['admin_password'] == password
@@ -0,0 +1,9 @@
+"""/metrics 里能看到文件目录的存储耗时"""
+
+
+def test_file_catalogue_operations_are_timed(app_module, client):
+    assert client.get('/api/files?limit=10').status_code == 200
+    app_module.files_catalog.all()
+    output = app_module.metrics.render()
+    for operation in ('files_page', 'files_all'):
+        assert f'storage_operation_duration_seconds_count{{operation="{operation}"}}' in output
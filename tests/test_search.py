@@ -0,0 +1,97 @@
+"""站内搜索：分词、前缀匹配、多个词同时命中、排序和增量同步"""
+import pytest
+
+
+def test_cjk_text_is_indexed_as_unigrams_and_bigrams(app_module):
+    assert app_module.search_tokens('前端开发') == ['前', '端', '开', '发', '前端', '端开', '开发']
+    # 查询时两个字以上只用双字（短语匹配），单个字用单字
+    assert app_module.search_tokens('前端开发', query=True) == ['前端', '端开', '开发']
+    assert app_module.search_tokens('前', query=True) == ['前']
+
+
+def test_ascii_words_are_normalized(app_module):
+    assert app_module.search_tokens('Hello, ＷＯＲＬＤ 2024!') == ['hello', 'world', '2024']
+    assert app_module.search_tokens('React前端') == ['react', '前', '端', '前端']
+
+
+@pytest.fixture
+def index(app_module, monkeypatch):
+    doc = {'projects': [
+        {'id': 'p1', 'title': '个人博客', 'tags': ['Flask'], 'description': '用 Python 写的博客系统'},
+        {'id': 'p2', 'title': 'Python 教程', 'tags': [], 'description': '入门'},
+        {'id': 'p3', 'title': '天气应用', 'tags': ['React'], 'description': '每天的天气预报，支持 python 脚本'},
+    ], 'modules': {}}
+    monkeypatch.setattr(app_module, 'read_data', lambda: doc)
+    app_module.files_catalog.replace_all([])
+    return app_module.SearchIndex()
+
+
+def ids(results):
+    return [record['id'] for _, _, record in results[0]]
+
+
+def test_prefix_matching(index):
+    assert sorted(ids(index.search('pyth'))) == ['p1', 'p2', 'p3']
+    assert ids(index.search('reac')) == ['p3']
+    assert ids(index.search('xyz')) == []
+
+
+def test_all_terms_must_match(index):
+    assert ids(index.search('python 博客')) == ['p1']
+    assert ids(index.search('python 天气')) == ['p3']
+    assert ids(index.search('博客 天气')) == []
+
+
+def test_cjk_phrase_matching(index):
+    assert ids(index.search('天气')) == ['p3']
+    assert ids(index.search('气应')) == ['p3']
+    assert ids(index.search('博')) == ['p1']
+    assert ids(index.search('客天')) == []  # 不相邻的两个字不算命中
+
+
+def test_title_hits_rank_above_description_hits(index):
+    results, total = index.search('python')
+    assert total == 3
+    assert results[0][2]['id'] == 'p2'
+    scores = [score for score, _, _ in results]
+    assert scores == sorted(scores, reverse=True)
+    # 完全匹配比前缀匹配得分高
+    assert index.search('python')[0][0][0] > index.search('pytho')[0][0][0]
+
+
+def test_files_are_resynced_on_content_changes_only(app_module, index, monkeypatch):
+    file_info = {'id': 'f1', 'original_name': '简历.pdf', 'filename': 'a.pdf', 'folder': '文档',
+                 'description': '', 'size': 1, 'upload_date': '2024-01-01 00:00:00', 'type': 'pdf', 'downloads': 0}
+    app_module.files_catalog.add_many([file_info])
+    assert ids(index.search('简历')) == ['f1']
+
+    loads = []
+    real_all = app_module.files_catalog.all
+    monkeypatch.setattr(app_module.files_catalog, 'all', lambda: loads.append(1) or real_all())
+    version = app_module.files_catalog.version()
+    app_module.files_catalog.add_downloads({'f1': 3})
+    assert app_module.files_catalog.version() != version
+    assert ids(index.search('简历')) == ['f1']
+    assert loads == []
+
+    app_module.files_catalog.add_many([dict(file_info, id='f2', original_name='简历-英文.pdf')])
+    assert sorted(ids(index.search('简历'))) == ['f1', 'f2']
+    assert loads == [1]
+
+
+def test_json_backend_content_version_ignores_downloads(app_module, tmp_path):
+    catalog = app_module.JsonFileCatalog(str(tmp_path / 'catalog.json'))
+    catalog.replace_all([{'id': 'a', 'original_name': 'a.txt', 'filename': 'a.txt', 'downloads': 0}])
+    content_version = catalog.content_version()
+    catalog.add_downloads({'a': 1})
+    assert catalog.content_version() == content_version
+    catalog.delete('a')
+    assert catalog.content_version() != content_version
+
+
+def test_search_endpoint(client):
+    assert client.get('/api/search').status_code == 400
+    assert client.get('/api/search?q=x&type=nope').status_code == 400
+    response = client.get('/api/search?q=示例')
+    assert response.status_code == 200
+    assert set(response.get_json()) == {'query', 'total', 'results'}
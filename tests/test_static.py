@@ -0,0 +1,23 @@
+"""静态文件的压缩版本"""
+import os
+
+
+def test_compressed_variant_for_assets(app_module, client):
+    response = client.get('/static/css/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    response.close()
+
+
+def test_no_variants_for_uploaded_files(app_module, client):
+    for folder in (app_module.UPLOAD_FOLDER, app_module.FILES_FOLDER):
+        with open(os.path.join(folder, 'notes.txt'), 'w') as f:
+            f.write('x' * 4096)
+    for url in ('/static/uploads/notes.txt', '/static/files/notes.txt'):
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response.headers
+        response.close()
+    variants = os.path.join(app_module.CACHE_FOLDER, 'static')
+    assert not os.path.exists(os.path.join(variants, 'uploads'))
+    assert not os.path.exists(os.path.join(variants, 'files'))
@@ -0,0 +1,34 @@
+"""GET /api/stats 的时间参数"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def test_stats_requires_login(client):
+    assert client.get('/api/stats?start=0').status_code == 401
+
+
+@pytest.mark.parametrize('query', [
+    'start=nan', 'start=inf', 'end=-inf', 'end=nan', 'start=1e300', 'start=yesterday',
+])
+def test_invalid_times_are_rejected(admin_client, query):
+    response = admin_client.get(f'/api/stats?{query}')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_zero_is_a_time_not_a_missing_value(app_module, admin_client):
+    response = admin_client.get('/api/stats?start=0&end=864000&granularity=day')
+    assert response.status_code == 200
+    first = app_module.bucket_start(datetime.fromtimestamp(0), 'day')
+    assert response.get_json()['start'] == datetime.fromtimestamp(first).strftime('%Y-%m-%d %H:%M')
+
+    # start=0 不会被当成“默认最近24小时”，和现在之间的范围按分钟太大
+    assert admin_client.get('/api/stats?start=0&granularity=minute').status_code == 400
+
+
+def test_default_range_is_last_day(admin_client):
+    response = admin_client.get('/api/stats?granularity=hour')
+    assert response.status_code == 200
+    start = datetime.strptime(response.get_json()['start'], '%Y-%m-%d %H:%M')
+    assert timedelta(hours=24) <= datetime.now() - start <= timedelta(hours=25)
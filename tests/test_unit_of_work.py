@@ -0,0 +1,36 @@
+"""多个 gunicorn worker 同时修改数据时不能丢失更新（DataUnitOfWork 在读改写期间持有跨进程的锁）"""
+import multiprocessing
+import os
+
+WORKERS = 4
+PROJECTS_PER_WORKER = 25
+
+
+def add_projects(app_module, worker):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    for i in range(PROJECTS_PER_WORKER):
+        response = client.post('/api/projects', json={'title': f'worker{worker}-{i}'})
+        if response.status_code != 200:
+            os._exit(1)
+    os._exit(0)
+
+
+def test_concurrent_workers_do_not_lose_updates(app_module):
+    before = len(app_module.read_data()['projects'])
+    # fork 出来的进程和 gunicorn 的 worker 一样，各自有自己的缓存和连接
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=add_projects, args=(app_module, worker)) for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0] * WORKERS
+
+    # 用新的 DocumentStore 从磁盘重新读取，不依赖本进程的缓存
+    store = app_module.DocumentStore(app_module.DATA_FILE, app_module.DATA_JOURNAL_FILE)
+    titles = [project['title'] for project in store.read()['projects']]
+    assert len(titles) == before + WORKERS * PROJECTS_PER_WORKER
+    expected = {f'worker{worker}-{i}' for worker in range(WORKERS) for i in range(PROJECTS_PER_WORKER)}
+    assert expected <= set(titles)